@@ -0,0 +1,222 @@
+# Throughput and latency benchmark of StreamController.
+# MindsDB is replaced with a local fake predict server (fake_mindsdb.py), input and output
+# are in-process streams, so only the controller, the http client and the cache are measured.
+#
+# every option accepts a comma separated list, all combinations are run:
+#   python benchmarks/bench_controller.py --mode regular --batch_size 1,10,100 --fields 10,100
+#   python benchmarks/bench_controller.py --mode timeseries --window 5,20 --groups 1,100,1000 --cache shelve,redis
+#   python benchmarks/bench_controller.py --stream queue,file --batch_size 100
+# redis cache uses REDIS_CACHE env var (json connection params), like the controller itself
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from itertools import product
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fake_mindsdb
+from mindsdb_streams import StreamController, QueueStream, FileStream
+from mindsdb_streams.base import BaseStream
+from mindsdb_streams.utils import log
+
+
+SENT_FIELD = '__sent'
+
+
+class LatencySink(BaseStream):
+    # output stream which records the end-to-end latency of every prediction
+    def __init__(self):
+        self.latencies = []
+        self.first = None
+        self.last = None
+        self._lock = threading.Lock()
+
+    def write(self, dct):
+        self.write_many([dct])
+
+    def write_many(self, records):
+        now = time.perf_counter()
+        with self._lock:
+            if self.first is None:
+                self.first = now
+            self.last = now
+            self.latencies.extend(now - record[SENT_FIELD] for record in records)
+
+    def __len__(self):
+        return len(self.latencies)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def make_record(i, fields, groups):
+    record = {f'x{j}': i + j for j in range(fields)}
+    record['order'] = i
+    record['group'] = f'g{i % groups}'
+    return record
+
+
+def expected_predictions(mode, records, window, groups):
+    if mode == 'regular':
+        return records
+    per_group, extra = divmod(records, groups)
+    return sum(max(per_group + (1 if g < extra else 0) - window + 1, 0) for g in range(groups))
+
+
+def feed(stream_in, records, fields, groups, rate):
+    # rate - records per second, 0 writes all records at once (backlog)
+    started = time.perf_counter()
+    if not rate:
+        batch = []
+        for i in range(records):
+            record = make_record(i, fields, groups)
+            record[SENT_FIELD] = time.perf_counter()
+            batch.append(record)
+        stream_in.write_many(batch)
+        return
+    for i in range(records):
+        delay = started + i / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        record = make_record(i, fields, groups)
+        record[SENT_FIELD] = time.perf_counter()
+        stream_in.write(record)
+
+
+def run_case(case, args):
+    predictor = 'bench_{}_{}'.format(case['mode'], int(time.time() * 1000000))
+    if case['mode'] == 'timeseries':
+        fake_mindsdb.PREDICTORS[predictor] = {'is_timeseries': True, 'window': case['window'],
+                                              'order_by': ['order'], 'group_by': ['group']}
+    else:
+        fake_mindsdb.PREDICTORS[predictor] = {}
+
+    if case['cache'] == 'redis':
+        os.environ['REDIS_CACHE'] = args.redis_cache
+    else:
+        os.environ.pop('REDIS_CACHE', None)
+
+    if case['stream'] == 'file':
+        stream_in = FileStream(os.path.join(os.environ['HOME'], predictor))
+    else:
+        stream_in = QueueStream()
+    sink = LatencySink()
+    controller = StreamController(predictor, predictor, stream_in, sink,
+                                  batch_size=case['batch_size'],
+                                  ts_bulk_size=case['ts_bulk_size'],
+                                  batch_linger=args.batch_linger,
+                                  max_in_flight=args.max_in_flight,
+                                  pipeline_workers=args.pipeline_workers,
+                                  poll_timeout=0.05)
+    expected = expected_predictions(case['mode'], args.records, case['window'], case['groups'])
+    requests_before = fake_mindsdb.STATS['requests']
+
+    worker = threading.Thread(target=controller.work)
+    worker.start()
+    started = time.perf_counter()
+    feed(stream_in, args.records, case['fields'], case['groups'], args.rate)
+    deadline = time.time() + args.timeout
+    while len(sink) < expected and time.time() < deadline:
+        time.sleep(0.01)
+    controller.stop_event.set()
+    worker.join()
+
+    elapsed = (sink.last or time.perf_counter()) - started
+    result = dict(case)
+    result.update({
+        'records': args.records,
+        'predictions': len(sink),
+        'expected': expected,
+        'requests': fake_mindsdb.STATS['requests'] - requests_before,
+        'seconds': round(elapsed, 3),
+        'records_per_second': round(args.records / elapsed, 1) if len(sink) >= expected else None,
+        'p50_ms': None,
+        'p99_ms': None,
+    })
+    for q, key in ((0.5, 'p50_ms'), (0.99, 'p99_ms')):
+        value = percentile(sink.latencies, q)
+        result[key] = round(value * 1000, 2) if value is not None else None
+    return result
+
+
+def parse_list(cast):
+    return lambda value: [cast(v) for v in value.split(',')]
+
+
+parser = argparse.ArgumentParser(description="StreamController throughput/latency benchmark")
+parser.add_argument('--stream', type=parse_list(str), default=['queue'],
+                    help="input stream: queue (in-process) and/or file (FileStream in a temp directory)")
+parser.add_argument('--mode', type=parse_list(str), default=['regular', 'timeseries'],
+                    help="regular and/or timeseries")
+parser.add_argument('--records', type=int, default=10000, help="records sent in every case")
+parser.add_argument('--fields', type=parse_list(int), default=[10], help="number of fields in a record")
+parser.add_argument('--batch_size', type=parse_list(int), default=[1, 100])
+parser.add_argument('--window', type=parse_list(int), default=[10], help="time-series window")
+parser.add_argument('--groups', type=parse_list(int), default=[10], help="number of time-series groups")
+parser.add_argument('--cache', type=parse_list(str), default=['shelve'], help="shelve and/or redis")
+parser.add_argument('--ts_bulk_size', type=parse_list(int), default=[1],
+                    help="max number of time-series windows in one request")
+parser.add_argument('--batch_linger', type=float, default=0.01)
+parser.add_argument('--max_in_flight', type=int, default=1)
+parser.add_argument('--pipeline_workers', type=int, default=0)
+parser.add_argument('--rate', type=float, default=0,
+                    help="input records per second, 0 sends all records at once")
+parser.add_argument('--predict_latency', type=float, default=0, help="seconds every predict request takes")
+parser.add_argument('--redis_cache', type=str, default=os.getenv('REDIS_CACHE', '{"host": "127.0.0.1"}'),
+                    help="json with redis connection params for redis cache")
+parser.add_argument('--timeout', type=float, default=300, help="max seconds for one case")
+parser.add_argument('--json', action='store_true', help="print results as json lines")
+
+
+def main():
+    args = parser.parse_args()
+    log.setLevel(os.getenv('LOGLEVEL', 'WARNING'))
+    server = fake_mindsdb.start(latency=args.predict_latency)
+    os.environ['MINDSDB_URL'] = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    # shelve cache files go to $HOME/cache
+    home = tempfile.mkdtemp()
+    os.environ['HOME'] = home
+
+    cases = []
+    for stream, mode, fields, batch_size, window, groups, cache, ts_bulk_size in product(
+            args.stream, args.mode, args.fields, args.batch_size, args.window, args.groups, args.cache,
+            args.ts_bulk_size):
+        if mode == 'regular':
+            # window, groups and cache don't matter for regular predictors
+            window, groups, cache, ts_bulk_size = None, 1, None, 1
+        else:
+            # time-series windows are batched by ts_bulk_size
+            batch_size = 1
+        case = {'stream': stream, 'mode': mode, 'fields': fields, 'batch_size': batch_size, 'window': window,
+                'groups': groups, 'cache': cache, 'ts_bulk_size': ts_bulk_size}
+        if case not in cases:
+            cases.append(case)
+
+    columns = ['stream', 'mode', 'fields', 'batch_size', 'window', 'groups', 'cache', 'ts_bulk_size', 'predictions', 'requests',
+               'seconds', 'records_per_second', 'p50_ms', 'p99_ms']
+    if not args.json:
+        print('\t'.join(columns))
+    try:
+        for case in cases:
+            result = run_case(case, args)
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print('\t'.join(str(result[c]) for c in columns))
+            sys.stdout.flush()
+    finally:
+        server.shutdown()
+        shutil.rmtree(home, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
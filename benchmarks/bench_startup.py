@@ -0,0 +1,61 @@
+# Cold start benchmark of make_stream.py entry point.
+# every run is a fresh interpreter which imports make_stream.py and the stream class
+# of the given type, like a stream pod does before connecting anywhere:
+#   python benchmarks/bench_startup.py --type kafka,redis --runs 20
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules which are expensive to import, reported when they are loaded
+HEAVY_MODULES = ('kafka', 'walrus', 'redis', 'pandas', 'pyarrow', 'requests', 'asyncio', 'http.server', 'mindsdb')
+
+STARTUP_CODE = """
+import sys, time, json
+start = time.perf_counter()
+sys.argv = ['make_stream.py']
+import make_stream
+make_stream.get_stream_class({stream_type!r})
+elapsed = time.perf_counter() - start
+print(json.dumps({{'import_seconds': elapsed, 'modules': [m for m in {modules!r} if m in sys.modules]}}))
+"""
+
+
+def run(stream_type):
+    code = STARTUP_CODE.format(stream_type=stream_type, modules=HEAVY_MODULES)
+    start = time.perf_counter()
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT)
+    result = json.loads(out.decode('utf-8').strip().splitlines()[-1])
+    result['process_seconds'] = time.perf_counter() - start
+    return result
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+parser = argparse.ArgumentParser(description="make_stream.py startup time benchmark")
+parser.add_argument('--type', type=lambda v: v.split(','), default=['kafka', 'redis'])
+parser.add_argument('--runs', type=int, default=10)
+
+
+def main():
+    args = parser.parse_args()
+    print('type\timport_ms\tprocess_ms\tmodules')
+    for stream_type in args.type:
+        results = [run(stream_type) for _ in range(args.runs)]
+        print('{}\t{:.1f}\t{:.1f}\t{}'.format(
+            stream_type,
+            median([r['import_seconds'] for r in results]) * 1000,
+            median([r['process_seconds'] for r in results]) * 1000,
+            ','.join(results[-1]['modules'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import json
+import time
+import threading
+from socketserver import ThreadingMixIn
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+# predictor name -> timeseries settings ({} for a regular predictor)
+PREDICTORS = {}
+STATS = {'requests': 0}
+_stats_lock = threading.Lock()
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # stand-in for the parts of MindsDB http api used by StreamController:
+    # predictor info and predict requests, a prediction is the input record with 'y' added
+    protocol_version = 'HTTP/1.1'
+    # headers and body are sent separately, with nagle every response would wait for a delayed ack
+    disable_nagle_algorithm = True
+    latency = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, obj, code=200):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _predictor(self):
+        parts = self.path.split('?')[0].rstrip('/').split('/')
+        if parts[-1] == 'predict':
+            return parts[-2]
+        return parts[-1]
+
+    def do_GET(self):
+        name = self._predictor()
+        if name not in PREDICTORS:
+            self._send({'message': f'predictor {name} not found'}, code=404)
+            return
+        self._send({'name': name, 'status': 'complete',
+                    'problem_definition': {'timeseries_settings': PREDICTORS[name]}})
+
+    def do_POST(self):
+        size = int(self.headers['Content-Length'])
+        when = json.loads(self.rfile.read(size))['when']
+        with _stats_lock:
+            STATS['requests'] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if isinstance(when, list):
+            self._send([dict(record, y=1) for record in when])
+        else:
+            self._send(dict(when, y=1))
+
+
+def start(port=0, latency=0):
+    # latency - seconds every predict request takes, returns the server, its port is server.server_address[1]
+    handler = type('Handler', (_Handler, ), {'latency': latency})
+    server = _Server(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -2,20 +2,92 @@ import sys
 import os
 import json
 import argparse
-from mindsdb_streams import KafkaStream, RedisStream, StreamController, StreamLearningController
+from datetime import datetime, timezone
+from mindsdb_streams import StreamController, StreamLearningController, MultiStreamController
+from mindsdb_streams.utils import METRICS
 
 
 parser = argparse.ArgumentParser()
 parser.add_argument('connection_info', type=str, help="json string with connection info")
-parser.add_argument('predictor', type=str, help="predictor model name")
+parser.add_argument('predictor', type=str,
+        help="predictor model name, or comma separated names to share the input stream")
 parser.add_argument('input_stream', type=str)
 parser.add_argument('output_stream', type=str)
 parser.add_argument('anomaly_stream', type=str)
-parser.add_argument('type', type=str.lower, choices=['kafka', 'redis'])
+parser.add_argument('type', type=str.lower, choices=['kafka', 'redis', 'file'])
 parser.add_argument('learning_params', type=str,
         help="json string with model learning params")
 parser.add_argument('learning_threshold', type=int,
         help="timeout for collecting training data")
+parser.add_argument('--batch_size', type=int, default=1,
+        help="max number of records sent in one predict request")
+parser.add_argument('--batch_linger', type=float, default=0,
+        help="max seconds a partial batch waits for more records")
+parser.add_argument('--max_in_flight', type=int, default=1,
+        help="max number of concurrent predict requests")
+parser.add_argument('--ts_tolerance', type=int, default=0,
+        help="number of out of order records tolerated in time-series windows")
+parser.add_argument('--ts_bulk_size', type=int, default=1,
+        help="max number of time-series windows sent in one predict request")
+parser.add_argument('--poll_max_records', type=int, default=500,
+        help="max number of records read from input stream at once")
+parser.add_argument('--poll_timeout', type=float, default=0.5,
+        help="max seconds to wait for input records in one poll")
+parser.add_argument('--scale_out', action='store_true',
+        help="run as one of several workers sharing the input stream through a consumer group, "
+             "time-series predictors need a kafka input stream and REDIS_CACHE")
+parser.add_argument('--pipeline_workers', type=int, default=0,
+        help="number of predict threads, enables reader/predict/writer pipeline if > 0")
+parser.add_argument('--pipeline_queue_size', type=int, default=100,
+        help="max number of tasks waiting between pipeline stages")
+parser.add_argument('--prediction_cache_size', type=int, default=0,
+        help="max number of cached prediction results, 0 disables the cache")
+parser.add_argument('--prediction_cache_ttl', type=float, default=300,
+        help="seconds a cached prediction result stays valid")
+parser.add_argument('--http_params', type=json.loads, default=None,
+        help="json string with http client params: pool_size, timeout, retries, backoff_factor, "
+             "upload_timeout")
+parser.add_argument('--metrics_port', type=int, default=None,
+        help="port of prometheus metrics endpoint, disabled by default")
+
+
+def parse_position(value):
+    # offset or unix timestamp in ms, iso dates are converted to timestamps, dates without an offset are UTC
+    try:
+        return int(value)
+    except ValueError:
+        date = datetime.fromisoformat(value)
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=timezone.utc)
+        return int(date.timestamp() * 1000)
+
+
+parser.add_argument('--backfill', action='store_true',
+        help="predict the input stream records from --backfill_start to --backfill_end and exit")
+parser.add_argument('--backfill_start', type=parse_position, default=None,
+        help="first offset or timestamp to predict, the oldest record by default")
+parser.add_argument('--backfill_end', type=parse_position, default=None,
+        help="offset or timestamp to stop at (exclusive), the current end of the stream by default")
+parser.add_argument('--backfill_by', type=str.lower, choices=['offset', 'timestamp'], default=None,
+        help="whether backfill range is given by offsets or by timestamps (ms or iso date), "
+             "timestamp for redis streams (the only supported one) and offset for others by default")
+parser.add_argument('--backfill_batch_size', type=int, default=1000,
+        help="max number of records or time-series windows sent in one predict request during backfill")
+
+
+def get_stream_class(stream_type):
+    # only the client library of the selected stream type is imported
+    if stream_type == 'redis':
+        from mindsdb_streams import RedisStream
+        return RedisStream
+    if stream_type == 'file':
+        # streams are directories under connection_info['path'], other keys are FileStream arguments
+        from mindsdb_streams import FileStream
+        return lambda stream, connection_info: FileStream(
+            os.path.join(connection_info.get('path', '.'), stream),
+            **{k: v for k, v in connection_info.items() if k != 'path'})
+    from mindsdb_streams import KafkaStream
+    return KafkaStream
 
 
 if __name__ == '__main__':
@@ -24,26 +96,86 @@ if __name__ == '__main__':
     sys.stdout.flush()
     stream_name = os.getenv("STREAM_NAME", "Foo")
     args = parser.parse_args()
+    # comma separated predictors (and their output/anomaly streams) share one input stream
+    predictors = args.predictor.split(',')
+    output_streams = args.output_stream.split(',')
+    anomaly_streams = args.anomaly_stream.split(',')
+    if len(output_streams) != len(predictors):
+        parser.error(f"{len(predictors)} predictors need as many output streams, got {len(output_streams)}")
+    # one anomaly stream may be shared by all predictors
+    if len(anomaly_streams) == 1:
+        anomaly_streams = anomaly_streams * len(predictors)
+    elif len(anomaly_streams) != len(predictors):
+        parser.error(f"{len(predictors)} predictors need one or {len(predictors)} anomaly streams, "
+                     f"got {len(anomaly_streams)}")
+    # redis stream entries are replayed by the time they were added
+    if args.backfill_by is None:
+        args.backfill_by = 'timestamp' if args.type == 'redis' else 'offset'
+    elif args.type == 'redis' and args.backfill_by != 'timestamp':
+        parser.error("redis streams are backfilled by timestamp, --backfill_by offset isn't supported")
     connection_info = json.loads(args.connection_info)
+    if args.metrics_port is not None:
+        METRICS.serve(args.metrics_port)
 
-    stream_class = RedisStream if args.type == 'redis' else KafkaStream
-    stream_out = stream_class(args.output_stream, connection_info)
-    stream_in = stream_class(args.input_stream, connection_info)
-    stream_anomaly = stream_class(args.anomaly_stream, connection_info) if args.anomaly_stream not in ('', None, 'None', 'none') else None
+    stream_class = get_stream_class(args.type)
+    input_connection_info = connection_info
+    if args.backfill and args.type == 'kafka':
+        # the replay must not move committed offsets of the live consumer group
+        input_connection_info = json.loads(args.connection_info)
+        consumer_params = input_connection_info.setdefault('advanced', {}).setdefault('consumer', {})
+        consumer_params.update(group_id=None, enable_auto_commit=False)
+    stream_in = stream_class(args.input_stream, input_connection_info)
     if args.learning_params and args.learning_threshold:
+        stream_out = stream_class(args.output_stream, connection_info)
         controller = StreamLearningController(stream_name,
                                               args.predictor,
                                               args.learning_params,
                                               args.learning_threshold,
                                               stream_in,
-                                              stream_out)
+                                              stream_out,
+                                              http_params=args.http_params)
     else:
+        controller_kwargs = dict(batch_size=args.batch_size,
+                                 batch_linger=args.batch_linger,
+                                 max_in_flight=args.max_in_flight,
+                                 ts_tolerance=args.ts_tolerance,
+                                 ts_bulk_size=args.ts_bulk_size,
+                                 poll_max_records=args.poll_max_records,
+                                 poll_timeout=args.poll_timeout,
+                                 scale_out=args.scale_out,
+                                 pipeline_workers=args.pipeline_workers,
+                                 pipeline_queue_size=args.pipeline_queue_size,
+                                 prediction_cache_size=args.prediction_cache_size,
+                                 prediction_cache_ttl=args.prediction_cache_ttl)
 
-        controller = StreamController(stream_name,
-                                      args.predictor,
-                                      stream_in,
-                                      stream_out,
-                                      stream_anomaly)
+        routes = []
+        for predictor, output_stream, anomaly_stream in zip(predictors, output_streams, anomaly_streams):
+            stream_out = stream_class(output_stream, connection_info)
+            stream_anomaly = stream_class(anomaly_stream, connection_info) if anomaly_stream not in ('', None, 'None', 'none') else None
+            routes.append(dict(predictor=predictor, stream_out=stream_out, stream_anomaly=stream_anomaly,
+                               **controller_kwargs))
+
+        if len(routes) > 1:
+            controller = MultiStreamController(stream_name,
+                                               stream_in,
+                                               routes,
+                                               poll_max_records=args.poll_max_records,
+                                               poll_timeout=args.poll_timeout,
+                                               http_params=args.http_params)
+        else:
+            controller = StreamController(stream_name,
+                                          routes[0]['predictor'],
+                                          stream_in,
+                                          routes[0]['stream_out'],
+                                          routes[0]['stream_anomaly'],
+                                          http_params=args.http_params,
+                                          **controller_kwargs)
 
     print(f"Created '{controller.__class__.__name__}' controller, stream name - {stream_name}")
-    controller.work()
+    if args.backfill:
+        if not isinstance(controller, StreamController):
+            raise Exception(f"backfill isn't supported by {controller.__class__.__name__}")
+        controller.backfill(args.backfill_start, args.backfill_end, by=args.backfill_by,
+                            batch_size=args.backfill_batch_size)
+    else:
+        controller.work()
@@ -0,0 +1,36 @@
+import json
+import argparse
+from mindsdb_streams import StreamSupervisor
+from mindsdb_streams.utils import METRICS
+
+
+parser = argparse.ArgumentParser(description="runs many streams in one process")
+parser.add_argument('config', type=str, nargs='?', default=None,
+        help='json file {"streams": [spec, ...]}, re-applied when it changes')
+parser.add_argument('--workers', type=int, default=4,
+        help="number of threads stepping regular and time-series controllers")
+parser.add_argument('--max_idle_delay', type=float, default=1,
+        help="max seconds between polls of an idle stream")
+parser.add_argument('--reload_interval', type=float, default=5,
+        help="seconds between config file checks")
+parser.add_argument('--control_port', type=int, default=None,
+        help="port of control api (/streams, /metrics), disabled by default")
+parser.add_argument('--metrics_port', type=int, default=None,
+        help="port of prometheus metrics endpoint, disabled by default")
+parser.add_argument('--http_params', type=json.loads, default=None,
+        help="json string with http client params: pool_size, timeout, retries, backoff_factor, "
+             "upload_timeout")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.metrics_port is not None:
+        METRICS.serve(args.metrics_port)
+    supervisor = StreamSupervisor(config_path=args.config,
+                                  workers=args.workers,
+                                  max_idle_delay=args.max_idle_delay,
+                                  reload_interval=args.reload_interval,
+                                  http_params=args.http_params)
+    if args.control_port is not None:
+        supervisor.serve(args.control_port)
+    supervisor.work()
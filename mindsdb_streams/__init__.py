@@ -1,4 +1,29 @@
-from .stream_controller import StreamController, StreamLearningController
-from .kafka_stream import KafkaStream
-from .redis_stream import RedisStream
-from .test_stream import TestStream
+import importlib
+
+# everything is imported on first use, so a process only loads
+# the client libraries of the stream type it actually runs
+_EXPORTS = {
+    'StreamController': '.stream_controller',
+    'StreamLearningController': '.stream_controller',
+    'MultiStreamController': '.stream_controller',
+    'KafkaStream': '.kafka_stream',
+    'RedisStream': '.redis_stream',
+    'TestStream': '.test_stream',
+    'QueueStream': '.queue_stream',
+    'FileStream': '.file_stream',
+    'StreamSupervisor': '.supervisor',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -1,8 +1,51 @@
+import time
 
 
 class BaseStream:
+    # callback(stream, record, exception) for writes which fail after write() returned
+    on_error = None
+    # callbacks(partitions) called when a stream consumed by a group of readers is rebalanced
+    on_assign = None
+    on_revoke = None
+    # True for streams whose group readers get disjoint partitions and which call on_revoke on rebalance
+    rebalanced = False
+
     def read(self):
         raise NotImplementedError
 
+    def read_batch(self, max_records=500, timeout=0.5):
+        # returns a list of records, waiting up to timeout seconds if there are none.
+        # streams which can bound the number of records read override this
+        records = list(self.read())
+        if not records:
+            time.sleep(timeout)
+        return records
+
     def write(self, dct):
         raise NotImplementedError
+
+    def write_many(self, records):
+        for dct in records:
+            self.write(dct)
+
+    def flush(self):
+        pass
+
+    def ack(self, count=None):
+        # acknowledges the oldest count (all by default) records returned by reads and not acknowledged yet,
+        # for streams which support it. the controller acks records once their predictions are written
+        pass
+
+    def seek_range(self, start=None, end=None, by='offset'):
+        # prepares a replay of the records from start up to end (exclusive), offsets or unix timestamps in ms
+        # depending on 'by', None is the oldest record / the last record at the time of the call.
+        # after that read_batch returns only records of the range, without waiting for new ones,
+        # and range_done() is True once all of them were read. used by StreamController.backfill
+        raise NotImplementedError(f"{self.__class__.__name__} doesn't support replay")
+
+    def range_done(self):
+        return False
+
+    def _report_error(self, dct, e):
+        if self.on_error is not None:
+            self.on_error(self, dct, e)
@@ -0,0 +1 @@
+from .file_stream import FileStream
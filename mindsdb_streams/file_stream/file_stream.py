@@ -0,0 +1,332 @@
+import os
+import json
+import time
+import struct
+
+from ..base import BaseStream
+from ..utils import log, get_codec
+
+
+# record frame: payload length, write time in ms, payload
+HEADER = struct.Struct('>IQ')
+SEGMENT_SUFFIX = '.log'
+OFFSET_SUFFIX = '.offset'
+
+
+class FileStream(BaseStream):
+    # local stream kept in a directory of append-only segment files.
+    # every record gets an offset (its number in the stream), a segment is named by the offset
+    # of its first record and a new one is started when the current one exceeds segment_bytes,
+    # with max_segments the oldest segments are deleted.
+    # every consumer has its committed offset in <consumer>.offset: records returned by read_batch
+    # are committed by ack(), so a restarted consumer continues after the last acknowledged record.
+    # one writer per directory is expected, readers may be other processes
+    def __init__(self, path, consumer='default', codec=None, segment_bytes=64 * 1024 * 1024, max_segments=None,
+                 read_chunk_bytes=1024 * 1024, fsync=False):
+        self.path = path
+        self.consumer = consumer
+        self.codec = get_codec(codec)
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.read_chunk_bytes = read_chunk_bytes
+        self.fsync = fsync
+        os.makedirs(self.path, exist_ok=True)
+        self.offset_file = os.path.join(self.path, consumer + OFFSET_SUFFIX)
+
+        self._writer = None
+        self._write_offset = None
+        self._segment_size = 0
+
+        self._reader = None
+        self._read_segment = None
+        self._buffer = bytearray()
+        # offset of the next record to read, the offset of the oldest record not acknowledged yet
+        # and the number of records read after it
+        self.offset = self._load_offset()
+        self._ack_offset = self.offset
+        self._pending = 0
+        # write time (ms) of the last record read
+        self.timestamp = None
+        # end offset of a replay, see seek_range
+        self._range_end = None
+
+    def _segment_path(self, base_offset):
+        return os.path.join(self.path, f'{base_offset:020d}{SEGMENT_SUFFIX}')
+
+    def _segments(self):
+        return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.path)
+                      if name.endswith(SEGMENT_SUFFIX))
+
+    @staticmethod
+    def _scan(f, max_records=None):
+        # skips whole frames from the current position of f,
+        # returns the number of frames skipped, f is left after the last complete frame
+        count = 0
+        while max_records is None or count < max_records:
+            pos = f.tell()
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                f.seek(pos)
+                break
+            size, _ = HEADER.unpack(header)
+            f.seek(size, os.SEEK_CUR)
+            if f.tell() > os.fstat(f.fileno()).st_size:
+                f.seek(pos)
+                break
+            count += 1
+        return count
+
+    # writing
+
+    def _open_writer(self):
+        if self._writer is not None:
+            return
+        segments = self._segments()
+        if not segments:
+            base = 0
+            self._writer = open(self._segment_path(base), 'ab')
+            self._write_offset = 0
+            self._segment_size = 0
+            return
+        base = segments[-1]
+        with open(self._segment_path(base), 'r+b') as f:
+            count = self._scan(f)
+            # a frame left incomplete by a crashed writer is dropped
+            end = f.tell()
+            if end < os.fstat(f.fileno()).st_size:
+                log.warning("%s: truncating incomplete record at the end of segment %s", self, base)
+                f.truncate(end)
+        self._writer = open(self._segment_path(base), 'ab')
+        self._write_offset = base + count
+        self._segment_size = end
+
+    def _roll_segment(self):
+        self._writer.close()
+        self._writer = open(self._segment_path(self._write_offset), 'ab')
+        self._segment_size = 0
+        if self.max_segments is not None:
+            for base in self._segments()[:-self.max_segments]:
+                os.remove(self._segment_path(base))
+
+    def write(self, dct):
+        self.write_many([dct])
+
+    def write_many(self, records):
+        self._open_writer()
+        now = int(time.time() * 1000)
+        chunks = []
+        for dct in records:
+            data = self.codec.encode(dct)
+            chunks.append(HEADER.pack(len(data), now))
+            chunks.append(data)
+        if not chunks:
+            return
+        data = b''.join(chunks)
+        self._writer.write(data)
+        self._writer.flush()
+        self._write_offset += len(chunks) // 2
+        self._segment_size += len(data)
+        if self._segment_size >= self.segment_bytes:
+            self._roll_segment()
+
+    def flush(self):
+        if self._writer is not None:
+            self._writer.flush()
+            if self.fsync:
+                os.fsync(self._writer.fileno())
+
+    def end_offset(self):
+        # offset the next written record gets
+        if self._writer is not None:
+            return self._write_offset
+        segments = self._segments()
+        if not segments:
+            return 0
+        with open(self._segment_path(segments[-1]), 'rb') as f:
+            return segments[-1] + self._scan(f)
+
+    # reading
+
+    def _load_offset(self):
+        try:
+            with open(self.offset_file) as f:
+                return json.load(f)['offset']
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def _commit(self, offset):
+        tmp = self.offset_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'offset': offset}, f)
+        os.replace(tmp, self.offset_file)
+
+    def _close_reader(self):
+        if self._reader is not None:
+            self._reader.close()
+        self._reader = None
+        self._read_segment = None
+        self._buffer = bytearray()
+
+    def seek(self, offset):
+        # the next read starts at offset, records read before aren't acknowledged
+        self._close_reader()
+        self.offset = offset
+        self._pending = 0
+
+    def _first_timestamp(self, base):
+        with open(self._segment_path(base), 'rb') as f:
+            header = f.read(HEADER.size)
+        return HEADER.unpack(header)[1] if len(header) == HEADER.size else None
+
+    def _offset_for_time(self, timestamp):
+        # offset of the first record written at or after timestamp (ms), only frame headers are read
+        segments = self._segments()
+        # the search starts in the last segment whose first record is older than timestamp
+        start = 0
+        for i, base in enumerate(segments):
+            first = self._first_timestamp(base)
+            if first is not None and first < timestamp:
+                start = i
+        for base in segments[start:]:
+            offset = base
+            with open(self._segment_path(base), 'rb') as f:
+                while True:
+                    header = f.read(HEADER.size)
+                    if len(header) < HEADER.size:
+                        break
+                    size, written = HEADER.unpack(header)
+                    if written >= timestamp:
+                        return offset
+                    f.seek(size, os.SEEK_CUR)
+                    offset += 1
+        return self.end_offset()
+
+    def seek_range(self, start=None, end=None, by='offset'):
+        # a replay doesn't change the committed offset of the consumer
+        if by == 'timestamp':
+            start = self._offset_for_time(start) if start is not None else None
+            end = self._offset_for_time(end) if end is not None else None
+        elif by != 'offset':
+            raise Exception(f"unknown replay position '{by}', expected offset or timestamp")
+        last = self.end_offset()
+        if start is None:
+            segments = self._segments()
+            start = segments[0] if segments else 0
+        self.seek(start)
+        self._range_end = last if end is None else min(end, last)
+
+    def range_done(self):
+        return self._range_end is not None and self.offset >= self._range_end
+
+    def _open_reader(self):
+        segments = self._segments()
+        if not segments:
+            return False
+        candidates = [base for base in segments if base <= self.offset]
+        if not candidates:
+            log.warning("%s: offset %s was deleted, continuing from %s", self, self.offset, segments[0])
+            self.offset = segments[0]
+            candidates = segments[:1]
+        self._read_segment = candidates[-1]
+        self._reader = open(self._segment_path(self._read_segment), 'rb')
+        skip = self.offset - self._read_segment
+        skipped = self._scan(self._reader, skip)
+        if skipped < skip:
+            # the offset isn't written yet
+            self.offset = self._read_segment + skipped
+        return True
+
+    def _next_segment(self):
+        later = [base for base in self._segments() if base > self._read_segment]
+        if not later:
+            return False
+        self._close_reader()
+        return self._open_reader()
+
+    def _read_records(self, max_records):
+        if self._range_end is not None:
+            max_records = min(max_records, self._range_end - self.offset)
+            if max_records <= 0:
+                return []
+        if self._reader is None and not self._open_reader():
+            return []
+        start = self.offset
+        records = []
+        while len(records) < max_records:
+            pos = 0
+            buffer = self._buffer
+            while len(records) < max_records and len(buffer) - pos >= HEADER.size:
+                size, timestamp = HEADER.unpack_from(buffer, pos)
+                end = pos + HEADER.size + size
+                if end > len(buffer):
+                    break
+                records.append(self.codec.decode(bytes(buffer[pos + HEADER.size:end])))
+                self.timestamp = timestamp
+                self.offset += 1
+                pos = end
+            del buffer[:pos]
+            if len(records) >= max_records:
+                break
+            data = self._reader.read(self.read_chunk_bytes)
+            if data:
+                buffer.extend(data)
+                continue
+            if buffer and os.fstat(self._reader.fileno()).st_size < self._reader.tell():
+                # the incomplete record was truncated by a restarted writer, reopened on the next read
+                self._close_reader()
+                break
+            # end of the segment, a newer segment means this one is complete
+            if buffer or not self._next_segment():
+                break
+        if records and not self._pending:
+            self._ack_offset = start
+        self._pending += len(records)
+        return records
+
+    def read_batch(self, max_records=500, timeout=0.5):
+        deadline = time.time() + timeout
+        while True:
+            records = self._read_records(max_records)
+            if records:
+                return records
+            if self.range_done():
+                return []
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return []
+            time.sleep(min(remaining, 0.05))
+
+    def read(self):
+        while True:
+            records = self.read_batch(timeout=0)
+            if not records:
+                return
+            for record in records:
+                yield record
+            self.ack()
+
+    def ack(self, count=None):
+        # a replay doesn't change the committed offset
+        count = self._pending if count is None else min(count, self._pending)
+        if count <= 0:
+            return
+        self._ack_offset += count
+        self._pending -= count
+        if self._range_end is None:
+            self._commit(self._ack_offset)
+
+    def close(self):
+        self._close_reader()
+        if self._writer is not None:
+            self.flush()
+            self._writer.close()
+            self._writer = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}: path={self.path}, consumer={self.consumer}"
@@ -3,42 +3,157 @@ from copy import deepcopy
 import kafka
 
 from ..base import BaseStream
+from ..utils import log, get_codec
+
+
+class _RebalanceListener(kafka.ConsumerRebalanceListener):
+    def __init__(self, stream):
+        self.stream = stream
+
+    def on_partitions_revoked(self, revoked):
+        log.debug("%s: partitions revoked - %s", self.stream, revoked)
+        if self.stream.on_revoke is not None:
+            self.stream.on_revoke(revoked)
+
+    def on_partitions_assigned(self, assigned):
+        log.debug("%s: partitions assigned - %s", self.stream, assigned)
+        if self.stream.on_assign is not None:
+            self.stream.on_assign(assigned)
 
 
 class KafkaStream(BaseStream):
-    def __init__(self, topic, connection_info, mode='rw'):
+    # producer - KafkaProducer to use instead of creating one, to share it between streams,
+    # a shared producer isn't closed by the stream
+    rebalanced = True
+
+    def __init__(self, topic, connection_info, mode='rw', producer=None):
         self.topic = topic
         self.producer_kwargs = {'acks': 'all'}
         if isinstance(connection_info, str):
             self.connection_info = json.loads(connection_info)
         else:
             self.connection_info = deepcopy(connection_info)
+        # async_write lets the producer batch messages (linger_ms, batch_size, compression_type
+        # from 'producer' params) instead of flushing after every message;
+        # the stream is flushed by the controller explicitly
+        self.async_write = self.connection_info.get('advanced', {}).get('async_write', False)
+        # fields used as message key, so all records of one time-series group go to one partition
+        self.key_by = self.connection_info.get('advanced', {}).get('key_by', [])
+        if self.async_write:
+            self.producer_kwargs['linger_ms'] = 5
         self.producer_kwargs.update(self.connection_info.get('advanced', {}).get('producer', {}))
         self.consumer_kwargs = {'consumer_timeout_ms': 1000}
         self.consumer_kwargs.update(self.connection_info.get('advanced', {}).get('consumer', {}))
-        self.producer = None
+        self.producer = producer
         self.consumer = None
+        self._own_producer = producer is None
+        # end offset of every replayed partition and partitions not read to the end yet, see seek_range
+        self._range_end = None
+        self._range_pending = None
 
         if 'advanced' in self.connection_info:
             del self.connection_info['advanced']
-        if 'w' in mode:
+        self.codec = get_codec(self.connection_info.pop('codec', None))
+        if 'w' in mode and self.producer is None:
             self.producer = kafka.KafkaProducer(**self.connection_info, **self.producer_kwargs)
         if 'r' in mode:
             self.consumer = kafka.KafkaConsumer(**self.connection_info, **self.consumer_kwargs)
-            self.consumer.subscribe(topics=[topic])
+            self.consumer.subscribe(topics=[topic], listener=_RebalanceListener(self))
 
     def read(self):
         for msg in self.consumer:
-            yield json.loads(msg.value)
+            yield self.codec.decode(msg.value)
+
+    def read_batch(self, max_records=500, timeout=0.5):
+        if self._range_end is not None:
+            return self._read_range_batch(max_records, timeout)
+        polled = self.consumer.poll(timeout_ms=int(timeout * 1000), max_records=max_records)
+        return [self.codec.decode(msg.value) for messages in polled.values() for msg in messages]
+
+    def seek_range(self, start=None, end=None, by='offset'):
+        # every partition of the topic is replayed, offsets apply to each partition (so they mostly make sense
+        # for single partition topics), timestamps are looked up per partition.
+        # the partitions are assigned to the consumer directly, so its group_id must not be the one
+        # of live consumers, otherwise committed offsets of the group are moved
+        if by not in ('offset', 'timestamp'):
+            raise Exception(f"unknown replay position '{by}', expected offset or timestamp")
+        partitions = [kafka.TopicPartition(self.topic, p)
+                      for p in sorted(self.consumer.partitions_for_topic(self.topic) or [])]
+        self.consumer.unsubscribe()
+        self.consumer.assign(partitions)
+        first = self.consumer.beginning_offsets(partitions)
+        last = self.consumer.end_offsets(partitions)
+        if by == 'timestamp':
+            starts = self._offsets_for_time(partitions, start, first, last)
+            ends = self._offsets_for_time(partitions, end, last, last)
+        else:
+            starts = {tp: first[tp] if start is None else min(max(start, first[tp]), last[tp]) for tp in partitions}
+            ends = {tp: last[tp] if end is None else min(end, last[tp]) for tp in partitions}
+        self._range_end = ends
+        self._range_pending = set()
+        for tp in partitions:
+            if starts[tp] < ends[tp]:
+                self.consumer.seek(tp, starts[tp])
+                self._range_pending.add(tp)
+        done = [tp for tp in partitions if tp not in self._range_pending]
+        if done:
+            self.consumer.pause(*done)
+        log.debug("%s: replaying %s", self, {tp.partition: (starts[tp], ends[tp]) for tp in partitions})
+
+    def _offsets_for_time(self, partitions, timestamp, default, last):
+        if timestamp is None:
+            return dict(default)
+        found = self.consumer.offsets_for_times({tp: timestamp for tp in partitions})
+        # None - no records at or after timestamp
+        return {tp: found[tp].offset if found.get(tp) is not None else last[tp] for tp in partitions}
+
+    def range_done(self):
+        return self._range_pending is not None and not self._range_pending
+
+    def _read_range_batch(self, max_records, timeout):
+        if self.range_done():
+            return []
+        polled = self.consumer.poll(timeout_ms=int(timeout * 1000), max_records=max_records)
+        records = []
+        for tp, messages in polled.items():
+            end = self._range_end.get(tp)
+            records.extend(self.codec.decode(msg.value) for msg in messages if end is None or msg.offset < end)
+        # offsets may have gaps (compaction, transaction markers), so the position tells when a partition is done
+        done = [tp for tp in self._range_pending if self.consumer.position(tp) >= self._range_end[tp]]
+        if done:
+            self.consumer.pause(*done)
+            self._range_pending.difference_update(done)
+        return records
+
+    def _send(self, dct):
+        key = str(tuple(dct.get(k) for k in self.key_by)).encode('utf-8') if self.key_by else None
+        future = self.producer.send(self.topic, self.codec.encode(dct), key=key)
+        future.add_errback(self._on_send_error, dct)
 
     def write(self, dct):
-        self.producer.send(self.topic, json.dumps(dct).encode('utf-8'))
-        self.producer.flush()
+        self._send(dct)
+        if not self.async_write:
+            self.producer.flush()
+
+    def write_many(self, records):
+        # one flush for the whole batch, so the producer can send it in few requests
+        for dct in records:
+            self._send(dct)
+        if not self.async_write:
+            self.producer.flush()
+
+    def _on_send_error(self, dct, e):
+        log.error("%s: unable to deliver message to %s - %s", self.__class__.__name__, self.topic, e)
+        self._report_error(dct, e)
+
+    def flush(self):
+        if self.producer:
+            self.producer.flush()
 
     def __del__(self):
         if self.consumer:
             self.consumer.close()
-        if self.producer:
+        if self.producer and self._own_producer:
             self.producer.close()
 
     def __repr__(self):
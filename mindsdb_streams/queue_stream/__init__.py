@@ -0,0 +1 @@
+from .queue_stream import QueueStream
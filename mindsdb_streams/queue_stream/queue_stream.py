@@ -0,0 +1,35 @@
+import queue
+
+from ..base import BaseStream
+
+
+class QueueStream(BaseStream):
+    # in-process stream backed by a bounded queue,
+    # write blocks when the queue is full
+    def __init__(self, maxsize=0):
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def read(self):
+        while True:
+            try:
+                yield self.queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def read_batch(self, max_records=500, timeout=0.5):
+        try:
+            records = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(records) < max_records:
+            try:
+                records.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return records
+
+    def write(self, dct):
+        self.queue.put(dct)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}: size={self.queue.qsize()}"
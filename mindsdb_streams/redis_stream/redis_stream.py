@@ -1,17 +1,59 @@
+import os
 import json
+import time
+import socket
 import walrus
+from redis.exceptions import ResponseError
 
 from ..base import BaseStream
+from ..utils import log, get_codec
+
+
+# connection_info keys handled by the stream itself, not passed to redis client
+STREAM_OPTIONS = ('codec', 'group', 'maxlen')
 
 
 class RedisStream(BaseStream):
-    def __init__(self, stream, connection_info):
+    # connection_info may contain:
+    #   maxlen - approximate max length of the stream, applied on every write
+    #   group - consumer group settings: {"name": ..., "consumer": ..., "claim_idle_ms": ...},
+    #     with a group records are read with XREADGROUP and acknowledged by ack(),
+    #     a restarted consumer (with the same name) first reads the records it left pending,
+    #     records left pending by other consumers for claim_idle_ms are claimed.
+    #     without a group records returned by read_batch are deleted by ack()
+    # client - walrus.Database to use instead of creating one, to share connections between streams
+    def __init__(self, stream, connection_info, client=None):
         if isinstance(connection_info, str):
             self.connection_info = json.loads(connection_info)
         else:
             self.connection_info = connection_info
-        self.client = walrus.Database(**self.connection_info)
+        self.codec = get_codec(self.connection_info.get('codec'))
+        self.maxlen = self.connection_info.get('maxlen')
+        self.client = client or walrus.Database(**{k: v for k, v in self.connection_info.items()
+                                                   if k not in STREAM_OPTIONS})
         self.stream = self.client.Stream(stream)
+        # next entry id and the last entry id of a replay, see seek_range
+        self._range_cursor = None
+        self._range_max = None
+
+        group = self.connection_info.get('group')
+        if isinstance(group, str):
+            group = {'name': group}
+        self.group = group['name'] if group else None
+        # ids of records returned by read_batch and not acknowledged yet
+        self._unacked = []
+        if self.group is not None:
+            self.consumer = group.get('consumer') or f"{socket.gethostname()}-{os.getpid()}"
+            self.claim_idle_ms = group.get('claim_idle_ms', 60000)
+            self._last_claim = 0
+            # position in the records left pending for this consumer, None once they are read
+            self._own_cursor = '0'
+            try:
+                self.client.xgroup_create(self.stream.key, self.group, id='0', mkstream=True)
+            except ResponseError as e:
+                # BUSYGROUP - group already exists
+                if 'BUSYGROUP' not in str(e):
+                    raise
 
     @staticmethod
     def _decode(redis_data):
@@ -20,17 +62,140 @@ class RedisStream(BaseStream):
             decoded[k.decode('utf8')] = redis_data[k].decode('utf8')
         return decoded
 
+    def _parse(self, when_data):
+        try:
+            return self.codec.decode(when_data[b''])
+        except KeyError:
+            return self._decode(when_data)
+
     def read(self):
+        if self.group is not None:
+            for record in self.read_batch(timeout=0):
+                yield record
+            self.ack()
+            return
         for k, when_data in self.stream.read():
-            try:
-                res = json.loads(when_data[b''])
-            except KeyError:
-                res = self._decode(when_data)
-            yield res
+            yield self._parse(when_data)
             self.stream.delete(k)
 
+    def read_batch(self, max_records=500, timeout=0.5):
+        if self._range_cursor is not None:
+            return self._read_range_batch(max_records)
+        if self.group is not None:
+            return self._read_group_batch(max_records, timeout)
+        # records read and not acknowledged yet are still in the stream, reading continues after them
+        last_id = self._unacked[-1] if self._unacked else None
+        messages = self.stream.read(count=max_records, block=int(timeout * 1000) or None, last_id=last_id)
+        if not messages:
+            return []
+        self._unacked.extend(k for k, _ in messages)
+        return [self._parse(when_data) for _, when_data in messages]
+
+    def seek_range(self, start=None, end=None, by='timestamp'):
+        # entry ids start with the time the entry was added (ms), so a range is given by timestamps.
+        # replayed entries are neither deleted nor acknowledged
+        if by != 'timestamp':
+            raise Exception("redis streams are replayed by timestamp")
+        self._range_cursor = '-' if start is None else str(start)
+        if end is not None:
+            # an id without sequence number as the upper bound includes every entry of that ms
+            self._range_max = str(end - 1)
+        else:
+            last = self.client.xrevrange(self.stream.key, count=1)
+            # an empty stream has nothing to replay
+            self._range_max = last[0][0].decode('utf8') if last else None
+
+    def range_done(self):
+        return self._range_cursor is not None and self._range_max is None
+
+    def _read_range_batch(self, max_records):
+        if self._range_max is None:
+            return []
+        messages = self.client.xrange(self.stream.key, min=self._range_cursor, max=self._range_max, count=max_records)
+        if len(messages) < max_records:
+            self._range_max = None
+        if messages:
+            self._range_cursor = self._next_id(messages[-1][0])
+        return [self._parse(when_data) for _, when_data in messages]
+
+    @staticmethod
+    def _next_id(entry_id):
+        entry_id = entry_id.decode('utf8') if isinstance(entry_id, bytes) else entry_id
+        ms, seq = entry_id.split('-')
+        return f'{ms}-{int(seq) + 1}'
+
+    def _read_own_pending(self, max_records):
+        # reading with an id instead of '>' returns records delivered to this consumer before, without blocking
+        resp = self.client.xreadgroup(self.group, self.consumer, {self.stream.key: self._own_cursor},
+                                      count=max_records)
+        messages = [message for _, stream_messages in resp or [] for message in stream_messages]
+        if messages:
+            log.info("%s: reading %s records left pending by this consumer", self, len(messages))
+        # reads with an id return records after it
+        self._own_cursor = messages[-1][0] if len(messages) == max_records else None
+        return messages
+
+    def _read_group_batch(self, max_records, timeout):
+        messages = self._read_own_pending(max_records) if self._own_cursor is not None else []
+        if len(messages) < max_records:
+            messages.extend(self._claim_pending(max_records - len(messages)))
+        if len(messages) < max_records:
+            resp = self.client.xreadgroup(self.group, self.consumer, {self.stream.key: '>'},
+                                          count=max_records - len(messages),
+                                          block=None if messages else int(timeout * 1000) or None)
+            for _, stream_messages in resp or []:
+                messages.extend(stream_messages)
+        # pending records deleted from the stream come without data, there is nothing to process
+        deleted = [k for k, when_data in messages if not when_data]
+        if deleted:
+            self.client.xack(self.stream.key, self.group, *deleted)
+        messages = [(k, when_data) for k, when_data in messages if when_data]
+        self._unacked.extend(k for k, _ in messages)
+        return [self._parse(when_data) for _, when_data in messages]
+
+    def _claim_pending(self, max_records):
+        now = time.time()
+        if max_records <= 0 or now - self._last_claim < self.claim_idle_ms / 1000:
+            return []
+        self._last_claim = now
+        # the pending list is scanned page by page, so records of live consumers at its start
+        # don't hide older idle records of dead ones
+        ids = []
+        start = '-'
+        page = max(max_records, 100)
+        while len(ids) < max_records:
+            pending = self.client.xpending_range(self.stream.key, self.group, start, '+', page)
+            for p in pending:
+                consumer = p['consumer'].decode('utf8') if isinstance(p['consumer'], bytes) else p['consumer']
+                if consumer != self.consumer and p['time_since_delivered'] >= self.claim_idle_ms:
+                    ids.append(p['message_id'])
+            if len(pending) < page:
+                break
+            start = self._next_id(pending[-1]['message_id'])
+        ids = ids[:max_records]
+        if not ids:
+            return []
+        log.info("%s: claiming %s pending records", self, len(ids))
+        return self.client.xclaim(self.stream.key, self.group, self.consumer, self.claim_idle_ms, ids)
+
+    def ack(self, count=None):
+        ids = self._unacked if count is None else self._unacked[:count]
+        if not ids:
+            return
+        if self.group is not None:
+            self.client.xack(self.stream.key, self.group, *ids)
+        else:
+            self.stream.delete(*ids)
+        del self._unacked[:len(ids)]
+
     def write(self, dct):
-        self.stream.add({'': json.dumps(dct)})
+        self.stream.add({'': self.codec.encode(dct)}, maxlen=self.maxlen)
+
+    def write_many(self, records):
+        pipe = self.client.pipeline(transaction=False)
+        for dct in records:
+            pipe.xadd(self.stream.key, {'': self.codec.encode(dct)}, maxlen=self.maxlen, approximate=True)
+        pipe.execute()
 
     def __repr__(self):
         return f"{self.__class__.__name__}: stream={self.stream}, connection={self.connection_info}"
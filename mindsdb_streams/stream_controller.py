@@ -1,15 +1,18 @@
 import os
+import json
 import time
 import traceback
-from threading import Event, Thread
-from tempfile import NamedTemporaryFile
+from itertools import count
+from queue import Queue
+from threading import Event, Thread, Lock
 import requests
-import pandas as pd
-from .utils import log, Cache
+from .utils import log, METRICS, PredictionClient, AsyncPredictionClient, WindowStore, PredictionCache, TrainingSpool, RollingSpool, \
+    MeanShiftDetector, TRAINING_DATA_FORMATS
+from .queue_stream import QueueStream
 
 
 class BaseController:
-    def __init__(self, name, predictor, stream_in, stream_out):
+    def __init__(self, name, predictor, stream_in, stream_out, http_params=None, client=None):
         self.name = name
         self.stream_in = stream_in
         self.stream_out = stream_out
@@ -31,6 +34,9 @@ class BaseController:
         self.predictors_url = "{}/predictors/".format(self.mindsdb_api_root)
         self.predict_url = "{}{}/predict".format(self.predictors_url, self.predictor)
         self.predictor_url = self.predictors_url + self.predictor
+        # http_params: pool_size, timeout, retries, backoff_factor, upload_timeout
+        self.http_params = http_params or {}
+        self.client = client or PredictionClient(headers=self.headers, **self.http_params)
 
         self.stop_event = Event()
 
@@ -39,7 +45,7 @@ class BaseController:
         cur_attempt = 0
         while cur_attempt < max_attempt:
             try:
-                res = requests.get(self.predictor_url, headers=self.headers)
+                res = self.client.get(self.predictor_url)
                 if res.status_code == requests.status_codes.codes.ok:
                     return True
             except Exception as e:
@@ -50,11 +56,76 @@ class BaseController:
 
 
 class StreamController(BaseController):
-    def __init__(self, name, predictor, stream_in, stream_out, stream_anomaly=None, in_thread=False):
-        super().__init__(name, predictor, stream_in, stream_out)
+    def __init__(self, name, predictor, stream_in, stream_out, stream_anomaly=None, in_thread=False,
+                 batch_size=1, batch_linger=0, max_in_flight=1, http_params=None, checkpoint_interval=5,
+                 ts_tolerance=0, poll_max_records=500, poll_timeout=0.5, scale_out=False,
+                 pipeline_workers=0, pipeline_queue_size=100, client=None,
+                 prediction_cache_size=0, prediction_cache_ttl=300, predictor_check_interval=30, metrics=None,
+                 ts_bulk_size=1):
+        super().__init__(name, predictor, stream_in, stream_out, http_params=http_params, client=client)
         self.stream_anomaly = stream_anomaly
-        log.info("%s: creating controller params: predictor=%s, stream_in=%s, stream_out=%s, stream_anomaly=%s",
-                 self.name, self.predictor, self.stream_in, self.stream_out, self.stream_anomaly)
+        # metrics registry, METRICS by default, see utils/metrics.py
+        self.metrics = metrics or METRICS
+        self._init_metrics()
+        # batch_size > 1 sends up to batch_size records in one predict request,
+        # batch_linger is the max number of seconds a partial batch waits for more records
+        self.batch_size = max(int(batch_size), 1)
+        self.batch_linger = batch_linger
+        self._batch = []
+        self._batch_started = None
+        # records of stream_in acknowledged so far, records whose predictions were written and flushed,
+        # records whose predictions were written and records taken into predict requests.
+        # stream_in.ack() is only called for records whose predictions are written (or failed to be predicted),
+        # predictions which failed to be written are kept in _unwritten and written again before anything
+        # new is read, so their records are delivered again after a restart (at least once)
+        self._acked_count = 0
+        self._processed_count = 0
+        self._written_count = 0
+        self._predicted_count = 0
+        self._unwritten = []
+        self._unwritten_read = 0
+        # stream_in is polled continuously, each poll returns up to poll_max_records records
+        # and waits up to poll_timeout seconds when there are none
+        self.poll_max_records = poll_max_records
+        self.poll_timeout = poll_timeout
+        # max_in_flight > 1 keeps that many predict requests running concurrently
+        self.max_in_flight = max(int(max_in_flight), 1)
+        self.async_client = None
+        if self.max_in_flight > 1:
+            self.async_client = AsyncPredictionClient(self.client, max_in_flight=self.max_in_flight,
+                                                      predict_func=self._request_prediction)
+        # seconds between saving time-series windows to the cache
+        self.checkpoint_interval = checkpoint_interval
+        # number of extra records a time-series group waits for before predicting,
+        # so records arriving slightly out of order are still placed correctly
+        self.ts_tolerance = ts_tolerance
+        # ts_bulk_size > 1 sends time-series windows ready in one polling cycle together,
+        # up to ts_bulk_size windows per predict request, see _predict_windows
+        self.ts_bulk_size = max(int(ts_bulk_size), 1)
+        # several controllers of one predictor share stream_in through a consumer group,
+        # time-series windows are kept in the shared redis cache (REDIS_CACHE) keyed by group_by value,
+        # which needs a stream assigning partitions on rebalance (kafka) keyed by group_by
+        self.scale_out = scale_out
+        # window store of a controller driven by step() calls, see open()
+        self._store = None
+        # histogram of per-group window sizes of the live window store, see _track_window_store
+        self._group_records = None
+        # pipeline_workers > 0 runs reading, predicting and writing in separate threads:
+        # one reader, pipeline_workers predict workers and one writer
+        # connected by queues of pipeline_queue_size tasks
+        self.pipeline_workers = pipeline_workers
+        self.pipeline_queue_size = pipeline_queue_size
+        # prediction_cache_size > 0 memoizes results of repeated when_data (or time-series windows),
+        # the cache is cleared when the predictor changes, which is checked every predictor_check_interval seconds
+        self.prediction_cache = None
+        if prediction_cache_size > 0:
+            self.prediction_cache = PredictionCache(max_size=prediction_cache_size, ttl=prediction_cache_ttl)
+        self.predictor_check_interval = predictor_check_interval
+        self._predictor_version = None
+        self._predictor_checked = time.time()
+        log.info("%s: creating controller params: predictor=%s, stream_in=%s, stream_out=%s, stream_anomaly=%s, batch_size=%s, batch_linger=%s, max_in_flight=%s",
+                 self.name, self.predictor, self.stream_in, self.stream_out, self.stream_anomaly,
+                 self.batch_size, self.batch_linger, self.max_in_flight)
         self.predictors_url = "{}/api/predictors/".format(self.mindsdb_url)
         self.predict_url = "{}{}/predict".format(self.predictors_url, self.predictor)
         self.predictor_url = self.predictors_url + self.predictor
@@ -62,36 +133,436 @@ class StreamController(BaseController):
             log.error("%s: unable to get prediction - predictor %s doesn't exists", self.name, self.predictor)
         self.ts_settings = self._get_ts_settings()
         log.info("%s: timeseries settings - %s", self.name, self.ts_settings)
+        self.write_errors = 0
+        for stream in self._output_streams():
+            stream.on_error = self._on_write_error
 
         if in_thread:
             self.thread = Thread(target=StreamController.work, args=(self,))
             self.thread.start()
 
+    def _init_metrics(self):
+        m, name = self.metrics, self.name
+        self._records_read = m.counter('records_read_total', 'records read from the input stream', controller=name)
+        self._read_seconds = m.histogram('read_seconds', 'input stream polls which returned records, including the wait',
+                                         controller=name)
+        self._predict_seconds = m.histogram('predict_seconds', 'predict http requests', controller=name)
+        self._cache_hits = m.counter('prediction_cache_hits_total', 'predictions served from the prediction cache',
+                                     controller=name)
+        self._read_count = 0
+        self._written = {
+            stream: m.counter('predictions_total', 'prediction results written', controller=name, stream=stream)
+            for stream in ('out', 'anomaly')
+        }
+        self._write_seconds = {
+            stream: m.histogram('write_seconds', 'output stream writes', controller=name, stream=stream)
+            for stream in ('out', 'anomaly')
+        }
+        self._flush_seconds = m.histogram('flush_seconds', 'output streams flushes', controller=name)
+        self._errors = {
+            stage: m.counter('errors_total', 'read, predict and write errors', controller=name, stage=stage)
+            for stage in ('read', 'predict', 'write')
+        }
+
+    def _track_queue(self, queue_name, queue):
+        gauge = self.metrics.gauge('queue_depth', 'items waiting in internal queues', controller=self.name,
+                                   queue=queue_name)
+        gauge.set_function(queue.qsize)
+
+    def _track_window_store(self, store):
+        labels = {'controller': self.name}
+        self.metrics.gauge('ts_groups', 'time-series groups held in memory', **labels).set_function(
+            lambda: len(store.groups))
+        self.metrics.gauge('ts_records', 'time-series records held in memory', **labels).set_function(
+            lambda: sum(len(records) for records in list(store.groups.values())))
+        # distribution of per-group window sizes, a gauge per group would be too many series
+        return self.metrics.histogram('ts_group_records', 'records held by a time-series group after an update',
+                                      buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000), **labels)
+
     def work(self):
         is_timeseries = self.ts_settings.get('is_timeseries', False)
         log.info("%s: is_timeseries - %s", self.name, is_timeseries)
+        if self.pipeline_workers > 0:
+            self._run_pipeline(is_timeseries)
+            return
         predict_func = self._make_ts_predictions if is_timeseries else self._make_predictions
         predict_func()
 
-    def _make_predictions(self):
-        while not self.stop_event.wait(0.5):
-            for data in self.stream_in.read():
-                log.debug("%s: received input data - %s", self.name, data)
+    def _run_pipeline(self, is_timeseries):
+        # the queues are bounded, so a slow stage blocks the previous one instead of piling up records.
+        # every task gets a sequence number and the writer restores the input order,
+        # which also keeps the order within every time-series group
+        tasks = Queue(maxsize=self.pipeline_queue_size)
+        results = Queue(maxsize=self.pipeline_queue_size)
+        self._track_queue('tasks', tasks)
+        self._track_queue('results', results)
+        threads = [Thread(target=self._pipeline_reader, args=(tasks, is_timeseries))]
+        threads.extend(Thread(target=self._pipeline_predictor, args=(tasks, results, is_timeseries))
+                       for _ in range(self.pipeline_workers))
+        threads.append(Thread(target=self._pipeline_writer, args=(results, is_timeseries)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # time-series records are kept by the window store, which is saved when the reader stops
+        self._ack_input(self._read_count if is_timeseries and not self._unwritten else self._processed_count)
+        self._log_unwritten()
+
+    def _pipeline_reader(self, tasks, is_timeseries):
+        # every task carries the number of records read up to it, which the writer reports once
+        # the task is written, so records are acknowledged only after their predictions are written
+        seq = count()
+        queued = 0
+        store = self._open_window_store() if is_timeseries else None
+        try:
+            while not self.stop_event.is_set():
+                self._ack_input(self._processed_count)
+                if is_timeseries:
+                    # the records are in the window store once the windows are ready
+                    for _, window_data in self._read_windows(store):
+                        tasks.put((next(seq), window_data, self._read_count))
+                else:
+                    for batch in self._read_batches():
+                        log.debug("%s: received input data - %s", self.name, batch)
+                        queued += len(batch)
+                        tasks.put((next(seq), batch if self.batch_size > 1 else batch[0], queued))
+        except Exception as e:
+            self._errors['read'].inc()
+            log.error("%s: reading error - %s", self.name, e)
+        finally:
+            if self._batch:
+                batch = self._pop_batch()
+                queued += len(batch)
+                tasks.put((next(seq), batch if self.batch_size > 1 else batch[0], queued))
+            for _ in range(self.pipeline_workers):
+                tasks.put(None)
+            if store is not None:
+                store.stop()
+
+    def _pipeline_predictor(self, tasks, results, is_timeseries):
+        while True:
+            task = tasks.get()
+            if task is None:
+                results.put(None)
+                return
+            seq, when_data, read = task
+            if not is_timeseries and self.batch_size > 1:
+                prediction = self._predict_batches([when_data])[0]
+            else:
                 try:
-                    prediction = self._predict(data)
-                    log.debug("%s: get predictions for %s - %s", self.name, data, prediction)
+                    prediction = self._predict(when_data)
                 except Exception as e:
-                    log.error("%s: prediction error - %s", self.name, e)
-                try:
+                    prediction = e
+            results.put((seq, when_data, prediction, read))
+
+    def _pipeline_writer(self, results, is_timeseries):
+        pending = {}
+        next_seq = 0
+        finished = 0
+        written = 0
+        while finished < self.pipeline_workers:
+            item = results.get()
+            if item is None:
+                finished += 1
+            else:
+                pending[item[0]] = item
 
-                    prediction = prediction if isinstance(prediction, list) else [prediction, ]
-                    for item in prediction:
-                        if self.stream_anomaly is not None and self._is_anomaly(item):
-                            self.stream_anomaly.write(item)
-                        else:
-                            self.stream_out.write(item)
+            out = []
+            while next_seq in pending:
+                _, when_data, prediction, read = pending.pop(next_seq)
+                next_seq += 1
+                written = max(written, read)
+                if isinstance(prediction, Exception):
+                    self._errors['predict'].inc()
+                    log.error("%s: prediction error - %s", self.name, prediction)
+                    continue
+                log.debug("%s: get predictions for %s - %s", self.name, when_data, prediction)
+                if is_timeseries:
+                    out.append(prediction[-1])
+                else:
+                    out.extend(prediction if isinstance(prediction, list) else [prediction, ])
+            # a failing output holds the writer, so the queues fill up and the reader waits too
+            while not self._write_results(out, written) and not self.stop_event.wait(self.poll_timeout):
+                out = []
+            if not self._unwritten and results.empty():
+                self._flush_written()
+        self._flush_written()
+
+    def _output_streams(self):
+        return [s for s in (self.stream_out, self.stream_anomaly) if s is not None]
+
+    def _on_write_error(self, stream, record, e):
+        self.write_errors += 1
+        self._errors['write'].inc()
+        log.error("%s: unable to write %s to %s - %s", self.name, record, stream, e)
+
+    def _flush_output(self):
+        with self._flush_seconds.time():
+            for stream in self._output_streams():
+                try:
+                    stream.flush()
                 except Exception as e:
-                    log.error("%s: writing error - %s", self.name, e)
+                    self._errors['write'].inc()
+                    log.error("%s: flush error for %s - %s", self.name, stream, e)
+
+    def open(self):
+        # prepares the controller to be driven by step() calls instead of work(),
+        # e.g. by StreamSupervisor, pipeline mode isn't supported this way
+        is_timeseries = self.ts_settings.get('is_timeseries', False)
+        log.info("%s: is_timeseries - %s", self.name, is_timeseries)
+        # windows are saved to the cache by step(), not by a thread of their own
+        self._store = self._open_window_store(background=False) if is_timeseries else None
+
+    def step(self):
+        # one polling cycle, returns the number of records read from stream_in
+        read_before = self._read_count
+        if self._store is not None:
+            self._ts_predictions_step(self._store)
+        else:
+            self._predictions_step()
+        return self._read_count - read_before
+
+    def close(self):
+        self._flush_pending_batch()
+        self._flush_written()
+        self._ack_input(self._processed_count)
+        self._log_unwritten()
+        if self._store is not None:
+            self._store.stop()
+            self._store = None
+        if self.async_client is not None:
+            self.async_client.close()
+            self.async_client = None
+
+    def backfill(self, start=None, end=None, by='offset', batch_size=1000):
+        # replays stream_in from start to end (offsets or unix timestamps in ms, see BaseStream.seek_range)
+        # and returns the number of records read once all of them are predicted.
+        # records are read without waiting for more, up to batch_size records (or time-series windows)
+        # are sent in one predict request and max_in_flight requests run concurrently.
+        # time-series windows are built from the replayed records only, in a store which is never saved,
+        # so the windows of the live controller aren't touched and the first window - 1 records
+        # of every group get no forecast
+        is_timeseries = self.ts_settings.get('is_timeseries', False)
+        log.info("%s: backfill from %s to %s by %s, is_timeseries - %s", self.name, start, end, by, is_timeseries)
+        self.stream_in.seek_range(start, end, by=by)
+        saved = self.batch_size, self.batch_linger, self.ts_bulk_size, self.poll_max_records, self._group_records
+        self.batch_size = self.ts_bulk_size = max(int(batch_size), 1)
+        # a partial batch is sent right away, every read returns enough records for all requests in flight
+        self.batch_linger = 0
+        self.poll_max_records = max(self.poll_max_records, self.batch_size * self.max_in_flight)
+        store = self._open_backfill_store() if is_timeseries else None
+        started = time.time()
+        read_before = self._read_count
+        try:
+            while not self.stop_event.is_set() and not self.stream_in.range_done():
+                if store is not None:
+                    self._ts_predictions_step(store)
+                else:
+                    self._predictions_step()
+        finally:
+            self.batch_size, self.batch_linger, self.ts_bulk_size, self.poll_max_records, self._group_records = saved
+            self._flush_output()
+        read = self._read_count - read_before
+        log.info("%s: backfill finished, %s records in %.1f seconds", self.name, read, time.time() - started)
+        return read
+
+    def _open_backfill_store(self):
+        order_by, _ = self._ts_columns()
+        store = WindowStore(f'{self.predictor}_backfill', order_by, self.ts_settings['window'],
+                            tolerance=self.ts_tolerance, cached=False)
+        # the throwaway store isn't tracked, metrics keep describing the live one
+        self._group_records = None
+        return store
+
+    def _make_predictions(self):
+        try:
+            while not self.stop_event.is_set():
+                self._predictions_step()
+        finally:
+            self._flush_pending_batch()
+            self._flush_written()
+            self._ack_input(self._processed_count)
+            self._log_unwritten()
+
+    def _flush_pending_batch(self):
+        # a partial batch waiting for batch_linger is predicted before its records are acknowledged
+        if self._batch:
+            self._process_batches([self._pop_batch()])
+
+    def _ack_input(self, processed):
+        # processed - number of records read so far whose predictions are written
+        count = processed - self._acked_count
+        if count > 0:
+            self.stream_in.ack(count)
+            self._acked_count = processed
+
+    def _write_results(self, results, read):
+        # writes predictions of the records up to read (counted by _read_count or _predicted_count)
+        # after the ones which failed to be written before, returns False if the write failed
+        results = self._unwritten + results
+        read = max(read, self._unwritten_read)
+        try:
+            self._write_predictions(results)
+        except Exception as e:
+            self._errors['write'].inc()
+            log.error("%s: writing error, %s predictions are kept - %s", self.name, len(results), e)
+            self._unwritten, self._unwritten_read = results, read
+            return False
+        self._unwritten, self._unwritten_read = [], 0
+        self._written_count = max(self._written_count, read)
+        return True
+
+    def _write_unwritten(self):
+        # True when there are no predictions left from a failed write,
+        # otherwise waits for poll_timeout, so a failing output isn't retried in a busy loop
+        if not self._unwritten or self._write_results([], 0):
+            return True
+        self.stop_event.wait(self.poll_timeout)
+        return False
+
+    def _flush_written(self):
+        self._flush_output()
+        self._processed_count = self._written_count
+
+    def _log_unwritten(self):
+        if self._unwritten:
+            log.warning("%s: %s predictions weren't written, their records aren't acknowledged",
+                        self.name, len(self._unwritten))
+
+    def _predictions_step(self):
+        if not self._write_unwritten():
+            return
+        in_flight = []
+        for batch in self._read_batches():
+            log.debug("%s: received input data - %s", self.name, batch)
+            in_flight.append(batch)
+            if len(in_flight) >= self.max_in_flight:
+                self._process_batches(in_flight)
+                in_flight = []
+        if in_flight:
+            self._process_batches(in_flight)
+        # records of a partial batch aren't predicted yet
+        self._flush_written()
+        self._ack_input(self._processed_count)
+
+    def _request_many(self, when_list):
+        # sends the requests (concurrently with max_in_flight > 1) bypassing the prediction cache,
+        # returns predictions (or exceptions) in when_list order
+        if self.async_client is not None and len(when_list) > 1:
+            return self.async_client.predict_all(self.predict_url, when_list)
+        results = []
+        for when_data in when_list:
+            try:
+                results.append(self._request_prediction(self.predict_url, when_data))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def _predict_many(self, when_list):
+        # returns predictions (or exceptions) in when_list order,
+        # cached results are not requested again
+        predictions = [self._cached_prediction(when_data) for when_data in when_list]
+        missed = [i for i, prediction in enumerate(predictions) if prediction is None]
+        for i, prediction in zip(missed, self._request_many([when_list[i] for i in missed])):
+            predictions[i] = prediction
+            if self.prediction_cache is not None and not isinstance(prediction, Exception):
+                self.prediction_cache.put(when_list[i], prediction)
+        return predictions
+
+    def _predict_batches(self, batches):
+        # like _predict_many for batches of records, every record is looked up in the prediction cache
+        # on its own, only the misses are requested and the results are merged back in batch order
+        if self.prediction_cache is None:
+            return self._request_many(batches)
+        cached = [[self._cached_prediction(record) for record in batch] for batch in batches]
+        missed = [[record for record, prediction in zip(batch, batch_cached) if prediction is None]
+                  for batch, batch_cached in zip(batches, cached)]
+        requested = [i for i, records in enumerate(missed) if records]
+        predictions = [list(batch_cached) for batch_cached in cached]
+        for i, prediction in zip(requested, self._request_many([missed[i] for i in requested])):
+            if not isinstance(prediction, Exception):
+                prediction = prediction if isinstance(prediction, list) else [prediction, ]
+            if isinstance(prediction, Exception) or len(prediction) != len(missed[i]):
+                # the cached part is dropped with an error or a broken response
+                predictions[i] = prediction
+                continue
+            results = iter(prediction)
+            for j, record in enumerate(batches[i]):
+                if predictions[i][j] is None:
+                    predictions[i][j] = next(results)
+                    self.prediction_cache.put(record, predictions[i][j])
+        return predictions
+
+    def _process_batches(self, batches):
+        when_list = [batch if self.batch_size > 1 else batch[0] for batch in batches]
+        predictions = self._predict_batches(batches) if self.batch_size > 1 else self._predict_many(when_list)
+
+        results = []
+        for batch, when_data, prediction in zip(batches, when_list, predictions):
+            if isinstance(prediction, Exception):
+                self._errors['predict'].inc()
+                log.error("%s: prediction error - %s", self.name, prediction)
+                continue
+            log.debug("%s: get predictions for %s - %s", self.name, when_data, prediction)
+            prediction = prediction if isinstance(prediction, list) else [prediction, ]
+            if self.batch_size > 1 and len(prediction) != len(batch):
+                log.warning("%s: got %s predictions for %s records", self.name, len(prediction), len(batch))
+            results.extend(prediction)
+        self._predicted_count += sum(len(batch) for batch in batches)
+        self._write_results(results, self._predicted_count)
+
+    def _read_input(self, timeout):
+        start = time.perf_counter()
+        try:
+            records = self.stream_in.read_batch(max_records=self.poll_max_records, timeout=timeout)
+        except Exception:
+            self._errors['read'].inc()
+            raise
+        if records:
+            self._read_count += len(records)
+            self._read_seconds.observe(time.perf_counter() - start)
+            self._records_read.inc(len(records))
+        return records
+
+    def _read_batches(self):
+        # a partial batch is kept between polling cycles
+        # until batch_linger seconds have passed since its first record
+        timeout = self.poll_timeout
+        if self._batch and self.batch_linger:
+            timeout = min(timeout, max(self.batch_linger - (time.time() - self._batch_started), 0))
+        for data in self._read_input(timeout):
+            if not self._batch:
+                self._batch_started = time.time()
+            self._batch.append(data)
+            if len(self._batch) >= self.batch_size or (self.batch_linger and self._is_batch_expired()):
+                yield self._pop_batch()
+        if self._batch and self._is_batch_expired():
+            yield self._pop_batch()
+
+    def _is_batch_expired(self):
+        return time.time() - self._batch_started >= self.batch_linger
+
+    def _pop_batch(self):
+        batch, self._batch = self._batch, []
+        return batch
+
+    def _write_predictions(self, predictions):
+        out, anomalies = [], []
+        for item in predictions:
+            if self.stream_anomaly is not None and self._is_anomaly(item):
+                anomalies.append(item)
+            else:
+                out.append(item)
+        if out:
+            log.debug("%s: writing %s prediction results to output stream", self.name, len(out))
+            with self._write_seconds['out'].time():
+                self.stream_out.write_many(out)
+            self._written['out'].inc(len(out))
+        if anomalies:
+            log.debug("%s: writing %s prediction results to anomaly stream", self.name, len(anomalies))
+            with self._write_seconds['anomaly'].time():
+                self.stream_anomaly.write_many(anomalies)
+            self._written['anomaly'].inc(len(anomalies))
 
     @staticmethod
     def _is_anomaly(res):
@@ -100,9 +571,7 @@ class StreamController(BaseController):
                 return True
         return False
 
-    def _make_ts_predictions(self):
-        window = self.ts_settings['window']
-
+    def _ts_columns(self):
         order_by = self.ts_settings['order_by']
         order_by = [order_by] if isinstance(order_by, str) else order_by
 
@@ -110,69 +579,265 @@ class StreamController(BaseController):
         if group_by is None:
             group_by = []
         group_by = [group_by] if isinstance(group_by, str) else group_by
+        return order_by, group_by
+
+    def _open_window_store(self, background=True):
+        if self.scale_out and not self.stream_in.rebalanced:
+            # every group must be read by one worker, otherwise workers hold and save different windows of it
+            raise Exception(f"scale_out of a time-series predictor isn't supported by "
+                            f"{self.stream_in.__class__.__name__}, it requires partitions assigned on rebalance")
+        if self.scale_out and not os.getenv("REDIS_CACHE"):
+            # a local cache isn't shared by the workers
+            raise Exception("scale_out of a time-series predictor requires REDIS_CACHE to be set")
+        order_by, _ = self._ts_columns()
+        store = WindowStore(f'{self.predictor}_cache', order_by, self.ts_settings['window'],
+                            tolerance=self.ts_tolerance, checkpoint_interval=self.checkpoint_interval,
+                            shared=self.scale_out)
+        if self.scale_out:
+            # groups owned by this worker are loaded from the shared cache when they show up,
+            # on rebalance all windows are saved and dropped, so new owners can pick them up
+            self.stream_in.on_revoke = lambda partitions: self._release_windows(store)
+        else:
+            store.restore()
+        store.start(background=background)
+        self._group_records = self._track_window_store(store)
+        return store
+
+    def _read_windows(self, store):
+        # reads one batch from stream_in into the store
+        # and yields (gb_value, window_data) for every window ready for prediction
+        order_by, group_by = self._ts_columns()
+        records = []
+        for when_data in self._read_input(self.poll_timeout):
+            log.debug("%s: received input data - %s", self.name, when_data)
+            records.append((self._group_key(when_data, order_by, group_by), when_data))
+
+        if self.scale_out:
+            store.load({gb_value for gb_value, _ in records})
+        for gb_value, when_data in records:
+            log.debug("%s: adding to the window - %s", self.name, when_data)
+            store.append(gb_value, when_data)
+
+        # only groups with new records can have a full window
+        for gb_value in store.pop_dirty():
+            if self._group_records is not None:
+                self._group_records.observe(store.size(gb_value))
+            for window_data in store.windows(gb_value):
+                log.debug("%s: windows - %s, cache size - %s", self.name, store.window, store.size(gb_value))
+                yield gb_value, window_data
+
+    def _make_ts_predictions(self):
+        store = self._open_window_store()
+        try:
+            while not self.stop_event.is_set():
+                self._ts_predictions_step(store)
+        finally:
+            # records of windows which weren't predicted and written aren't acknowledged
+            self._flush_written()
+            self._ack_input(self._processed_count)
+            self._log_unwritten()
+            store.stop()
+
+    def _ts_predictions_step(self, store):
+        if not self._write_unwritten():
+            return
+        results = []
+        if self.ts_bulk_size > 1:
+            results = self._predict_windows(list(self._read_windows(store)))
+        else:
+            for _, window_data in self._read_windows(store):
+                try:
+                    res_list = self._predict(when_data=window_data)
+                except Exception as e:
+                    self._errors['predict'].inc()
+                    log.error("%s: prediction error - %s", self.name, e)
+                    continue
+                log.debug("%s: prediction result - %s", self.name, res_list[-1])
+                results.append(res_list[-1])
+        # records which only filled windows are done as well
+        self._write_results(results, self._read_count)
+        self._flush_written()
+        self._ack_input(self._processed_count)
+        store.maybe_checkpoint()
+
+    def _predict_windows(self, windows):
+        # windows - (gb_value, window_data) in the order of _read_windows,
+        # returns the forecast of every window in the same order.
+        # consecutive windows of a group (a backlog) differ by one record, so they are sent as one span:
+        # the first window followed by the last record of every next one, MindsDB returns a row
+        # per input record and the row of a window's last record is its forecast.
+        # spans of different groups are concatenated into one request of up to ts_bulk_size windows,
+        # a request never holds two spans of one group.
+        # every window is looked up in the prediction cache on its own, spans are built from the misses
+        window = self.ts_settings['window']
+        groups = {}
+        for gb_value, window_data in windows:
+            groups.setdefault(gb_value, []).append(window_data)
+
+        # (gb_value, window number) -> forecast
+        forecasts = {}
+        # (gb_value, first window number, records) of every span, split to fit into requests
+        spans = []
+        for gb_value, group_windows in groups.items():
+            runs = []
+            for i, window_data in enumerate(group_windows):
+                cached = self._cached_prediction(window_data)
+                if cached is not None:
+                    forecasts[(gb_value, i)] = cached[-1]
+                elif runs and runs[-1][-1] == i - 1:
+                    runs[-1].append(i)
+                else:
+                    runs.append([i])
+            for run in runs:
+                for start in range(0, len(run), self.ts_bulk_size):
+                    part = run[start:start + self.ts_bulk_size]
+                    records = list(group_windows[part[0]]) + [group_windows[i][-1] for i in part[1:]]
+                    spans.append((gb_value, part[0], records))
+        # spans with the same start number belong to different groups
+        spans.sort(key=lambda span: span[1])
+
+        requests_spans = []
+        current, current_groups, current_windows = [], set(), 0
+        for span in spans:
+            span_windows = len(span[2]) - window + 1
+            if current and (span[0] in current_groups or current_windows + span_windows > self.ts_bulk_size):
+                requests_spans.append(current)
+                current, current_groups, current_windows = [], set(), 0
+            current.append(span)
+            current_groups.add(span[0])
+            current_windows += span_windows
+        if current:
+            requests_spans.append(current)
+
+        when_list = [[record for _, _, records in request for record in records] for request in requests_spans]
+        predictions = self._request_many(when_list)
+
+        for request, when_data, prediction in zip(requests_spans, when_list, predictions):
+            if isinstance(prediction, Exception):
+                self._errors['predict'].inc()
+                log.error("%s: prediction error - %s", self.name, prediction)
+                continue
+            if not isinstance(prediction, list) or len(prediction) != len(when_data):
+                log.warning("%s: got %s predictions for %s records, predicting windows one by one",
+                            self.name, len(prediction) if isinstance(prediction, list) else 1, len(when_data))
+                span_forecasts = [self._predict_span(records, window) for _, _, records in request]
+            elif not self._rows_match(prediction, when_data):
+                log.warning("%s: predicted rows don't match the records sent, predicting windows one by one",
+                            self.name)
+                span_forecasts = [self._predict_span(records, window) for _, _, records in request]
+            else:
+                span_forecasts = []
+                offset = 0
+                for _, _, records in request:
+                    span_forecasts.append(prediction[offset + window - 1:offset + len(records)])
+                    offset += len(records)
+            for (gb_value, start, _), span_forecast in zip(request, span_forecasts):
+                for i, forecast in enumerate(span_forecast, start):
+                    if forecast is None:
+                        continue
+                    forecasts[(gb_value, i)] = forecast
+                    if self.prediction_cache is not None:
+                        # the same value as a window predicted on its own would get
+                        self.prediction_cache.put(groups[gb_value][i], [forecast])
+
+        results = []
+        for gb_value, group_windows in groups.items():
+            for i in range(len(group_windows)):
+                if (gb_value, i) in forecasts:
+                    results.append(forecasts[(gb_value, i)])
+        return results
+
+    def _rows_match(self, rows, records):
+        # every returned row has the group_by and order_by values of the record at its position,
+        # columns missing from a row aren't checked
+        order_by, group_by = self._ts_columns()
+        for row, record in zip(rows, records):
+            if not isinstance(row, dict):
+                return False
+            for column in group_by + order_by:
+                if column in row and row[column] != record.get(column) and str(row[column]) != str(record.get(column)):
+                    return False
+        return True
+
+    def _predict_span(self, records, window):
+        # forecasts of every window of the span predicted one by one, None for failed ones
+        results = []
+        for i in range(len(records) - window + 1):
+            try:
+                results.append(self._request_prediction(self.predict_url, records[i:i + window])[-1])
+            except Exception as e:
+                self._errors['predict'].inc()
+                log.error("%s: prediction error - %s", self.name, e)
+                results.append(None)
+        return results
+
+    @staticmethod
+    def _group_key(when_data, order_by, group_by):
+        for ob in order_by:
+            if ob not in when_data:
+                raise Exception(f'when_data doesn\'t contain order_by[{ob}]')
 
-        cache = Cache(f'{self.predictor}_cache')
-        while not self.stop_event.wait(0.5):
-            for when_data in self.stream_in.read():
-                log.debug("%s: received input data - %s", self.name, when_data)
-                for ob in order_by:
-                    if ob not in when_data:
-                        raise Exception(f'when_data doesn\'t contain order_by[{ob}]')
-
-                for gb in group_by:
-                    if gb not in when_data:
-                        raise Exception(f'when_data doesn\'t contain group_by[{gb}]')
-
-                gb_value = tuple(when_data[gb] for gb in group_by) if group_by else ''
-
-                # because cache doesn't work for tuples
-                # (raises Exception: tuple doesn't have "encode" attribute)
-                gb_value = str(gb_value)
-
-                with cache:
-                    if gb_value not in cache:
-                        log.debug("%s: creating cache for gb - %s", self.name, gb_value)
-                        cache[gb_value] = []
-
-                    # do this because shelve-cache doesn't support
-                    # in-place changing
-                    records = cache[gb_value]
-                    log.debug("%s: adding to the cache - %s", self.name, when_data)
-                    records.append(when_data)
-                    cache[gb_value] = records
-
-            with cache:
-                for gb_value in cache.keys():
-                    if len(cache[gb_value]) >= window:
-                        cache[gb_value] = [*sorted(
-                            cache[gb_value],
-                            # WARNING: assuming wd[ob] is numeric
-                            key=lambda wd: tuple(wd[ob] for ob in order_by)
-                        )]
-                        while len(cache[gb_value]) >= window:
-                            log.debug("%s: windows - %s, cache size - %s", self.name, window, len(cache[gb_value]))
-
-                            res_list = self._predict(when_data=cache[gb_value][:window])
-                            if self.stream_anomaly is not None and self._is_anomaly(res_list[-1]):
-                                log.debug("%s: writing '%s' as prediction result to anomaly stream",
-                                          self.name, res_list[-1])
-                                self.stream_anomaly.write(res_list[-1])
-                            else:
-                                log.debug("%s: writing '%s' as prediction result to output stream",
-                                          self.name, res_list[-1])
-                                self.stream_out.write(res_list[-1])
-                            cache[gb_value] = cache[gb_value][1:]
+        for gb in group_by:
+            if gb not in when_data:
+                raise Exception(f'when_data doesn\'t contain group_by[{gb}]')
+
+        gb_value = tuple(when_data[gb] for gb in group_by) if group_by else ''
+
+        # because cache doesn't work for tuples
+        # (raises Exception: tuple doesn't have "encode" attribute)
+        return str(gb_value)
+
+    def _release_windows(self, store):
+        log.info("%s: input partitions revoked, releasing %s time-series groups", self.name, len(store.keys()))
+        self._flush_output()
+        store.release()
 
     def _predict(self, when_data):
-        params = {"when": when_data, 'format_flag': 'dict'}
-        res = requests.post(self.predict_url, json=params, headers=self.headers)
-        if res.status_code != requests.status_codes.codes.ok:
-            raise Exception(f"unable to get prediction for {when_data}: {res.text}")
-        return res.json()
+        prediction = self._cached_prediction(when_data)
+        if prediction is not None:
+            return prediction
+        prediction = self._request_prediction(self.predict_url, when_data)
+        if self.prediction_cache is not None:
+            self.prediction_cache.put(when_data, prediction)
+        return prediction
+
+    def _request_prediction(self, url, when_data):
+        with self._predict_seconds.time():
+            return self.client.predict(url, when_data)
+
+    def _cached_prediction(self, when_data):
+        if self.prediction_cache is None:
+            return None
+        if time.time() - self._predictor_checked >= self.predictor_check_interval:
+            self._check_predictor_version()
+        prediction = self.prediction_cache.get(when_data)
+        if prediction is not None:
+            self._cache_hits.inc()
+        return prediction
+
+    @staticmethod
+    def _get_predictor_version(predictor_info):
+        return tuple(predictor_info.get(k) for k in ('created_at', 'updated_at', 'accuracy', 'mindsdb_version'))
+
+    def _check_predictor_version(self):
+        self._predictor_checked = time.time()
+        try:
+            res = self.client.get(self.predictor_url)
+            res.raise_for_status()
+            version = self._get_predictor_version(res.json())
+        except Exception as e:
+            log.debug("%s: error getting predictor(%s) info - %s", self.name, self.predictor, e)
+            return
+        if version != self._predictor_version:
+            log.info("%s: predictor %s has changed, clearing %s cached predictions",
+                     self.name, self.predictor, len(self.prediction_cache))
+            self._predictor_version = version
+            self.prediction_cache.clear()
 
     def _get_ts_settings(self):
-        res = requests.get(self.predictor_url, headers=self.headers)
+        res = self.client.get(self.predictor_url)
         try:
+            self._predictor_version = self._get_predictor_version(res.json())
             ts_settings = res.json()['problem_definition']['timeseries_settings']
         except KeyError as e:
             log.error("%s - api error: unable to get timeseries settings for %s url - %s",
@@ -181,87 +846,279 @@ class StreamController(BaseController):
         return ts_settings if res.status_code == requests.status_codes.codes.ok else {}
 
 
+class MultiStreamController:
+    # reads and decodes stream_in once and feeds the records to several predictors.
+    # every route is a dict with 'predictor', 'stream_out' and optional
+    # StreamController arguments ('stream_anomaly', 'batch_size', ...),
+    # each predictor runs in its own StreamController with its own ts settings
+    def __init__(self, name, stream_in, routes, queue_size=10000, poll_max_records=500, poll_timeout=0.5,
+                 http_params=None, in_thread=False, metrics=None):
+        self.name = name
+        self.stream_in = stream_in
+        self.poll_max_records = poll_max_records
+        self.poll_timeout = poll_timeout
+        self.stop_event = Event()
+        self.controllers = []
+        self.queues = []
+        self._acked_count = 0
+        client = None
+        for route in routes:
+            route = dict(route)
+            predictor = route.pop('predictor')
+            stream_out = route.pop('stream_out')
+            queue_stream = QueueStream(maxsize=queue_size)
+            route.setdefault('http_params', http_params)
+            route.setdefault('metrics', metrics)
+            controller = StreamController(f"{self.name}_{predictor}", predictor, queue_stream, stream_out,
+                                          client=client, **route)
+            # all routes share one connection pool, they are stopped by work() once their queues are drained
+            client = controller.client
+            controller._track_queue('input', queue_stream.queue)
+            self.controllers.append(controller)
+            self.queues.append(queue_stream)
+        log.info("%s: multi predictor controller: stream_in=%s, predictors=%s",
+                 self.name, self.stream_in, [c.predictor for c in self.controllers])
+
+        if in_thread:
+            self.thread = Thread(target=MultiStreamController.work, args=(self,))
+            self.thread.start()
+
+    def _ack_written(self):
+        # every route gets the records in the same order and counts the ones it has written,
+        # a record is acknowledged once all routes have written its predictions
+        written = min(controller._acked_count for controller in self.controllers)
+        if written > self._acked_count:
+            self.stream_in.ack(written - self._acked_count)
+            self._acked_count = written
+
+    def work(self):
+        threads = [Thread(target=controller.work) for controller in self.controllers]
+        for thread in threads:
+            thread.start()
+        try:
+            while not self.stop_event.is_set():
+                self._ack_written()
+                records = self.stream_in.read_batch(max_records=self.poll_max_records, timeout=self.poll_timeout)
+                if not records:
+                    continue
+                log.debug("%s: received %s records", self.name, len(records))
+                # blocks when a predictor falls behind by queue_size records
+                for queue_stream in self.queues:
+                    queue_stream.write_many(records)
+        except Exception as e:
+            log.error("%s: reading error - %s", self.name, e)
+        finally:
+            self.stop_event.set()
+            # queued records are predicted before the routes stop, unless a route fails to write,
+            # a stopping route predicts the records it has already read
+            while any(not queue_stream.queue.empty() for queue_stream in self.queues) and \
+                    all(thread.is_alive() for thread in threads) and \
+                    not any(controller._unwritten for controller in self.controllers):
+                time.sleep(0.05)
+                self._ack_written()
+            for controller in self.controllers:
+                controller.stop_event.set()
+            for thread in threads:
+                thread.join()
+            self._ack_written()
+
+
 class StreamLearningController(BaseController):
-    def __init__(self, name, predictor, learning_params, learning_threshold, stream_in, stream_out, in_thread=False):
-        super().__init__(name, predictor, stream_in, stream_out)
+    def __init__(self, name, predictor, learning_params, learning_threshold, stream_in, stream_out, in_thread=False,
+                 http_params=None, client=None):
+        super().__init__(name, predictor, stream_in, stream_out, http_params=http_params, client=client)
+        if isinstance(learning_params, str):
+            learning_params = json.loads(learning_params)
         self.learning_params = learning_params
+        # 'collection' params aren't sent to MindsDB, they limit training data:
+        # max_rows, max_bytes, sample_size (reservoir sampling), chunk_size
+        self.collection_params = self.learning_params.pop('collection', {})
+        # format of uploaded training data: csv, csv.gz, parquet or arrow
+        self.upload_format = self.learning_params.pop('upload_format', 'csv')
+        # 'retraining' params switch the controller to continuous mode: it keeps a rolling window
+        # of training data and retrains the predictor every 'interval' seconds or on drift, see _learn_continuously
+        self.retraining_params = self.learning_params.pop('retraining', None)
         self.learning_threshold = learning_threshold
-        self.learning_data = []
-        self.training_ds_name = "{}_training_ds_{}".format(self.predictor,
-                                                           time.strftime("%Y_%m_%d_%H_%M_%S",
-                                                                         time.gmtime()))
-        log.info("%s: learning controller params: predictor=%s, learning_params=%s, learning_threshold=%s, stream_in=%s, stream_out=%s",
-                 self.name, self.predictor, self.learning_params, self.learning_threshold, self.stream_in, self.stream_out)
-
-        # for consistency only
-        self.stop_event = Event()
+        self.training_ds_name = self._new_training_ds_name()
+        log.info("%s: learning controller params: predictor=%s, learning_params=%s, learning_threshold=%s, retraining=%s, stream_in=%s, stream_out=%s",
+                 self.name, self.predictor, self.learning_params, self.learning_threshold, self.retraining_params,
+                 self.stream_in, self.stream_out)
 
         if in_thread:
             self.thread = Thread(target=StreamLearningController.work, args=(self,))
             self.thread.start()
 
     def work(self):
-        self._learn_model()
-
-    def _upload_file(self, df):
-        with NamedTemporaryFile(mode='w+', newline='', delete=False) as f:
-            df.to_csv(f, index=False)
-            f.flush()
-            url = f'{self.mindsdb_api_root}/files/{self.training_ds_name}'
-            data = {
-                "file": (f.name, f, 'text/csv')
-            }
-            res = requests.put(url, files=data)
-            res.raise_for_status()
+        if self.retraining_params is not None:
+            self._learn_continuously()
+        else:
+            self._learn_model()
+
+    def _new_training_ds_name(self):
+        return "{}_training_ds_{}".format(self.predictor, time.strftime("%Y_%m_%d_%H_%M_%S", time.gmtime()))
+
+    def _upload_file(self, path):
+        extension, content_type = TRAINING_DATA_FORMATS[self.upload_format]
+        url = f'{self.mindsdb_api_root}/files/{self.training_ds_name}'
+        res = self.client.upload_file(url, path, filename=f'{self.training_ds_name}.{extension}',
+                                      content_type=content_type)
+        res.raise_for_status()
 
     def _collect_training_data(self):
+        spool = TrainingSpool(**self.collection_params)
         threshold = time.time() + self.learning_threshold
-        while time.time() < threshold:
-            self.learning_data.extend(self.stream_in.read())
-            time.sleep(0.2)
-        return pd.DataFrame.from_records(self.learning_data)
+        while time.time() < threshold and not spool.is_full and not self.stop_event.is_set():
+            spool.add_many(self.stream_in.read_batch(timeout=0.2))
+            self.stream_in.ack()
+        log.info("%s: collected %s training records", self.name, spool.rows)
+        return spool
 
     def _cleanup(self):
         delete_url = self.mindsdb_api_root + "/streams/" + self.name
-        res = requests.delete(delete_url)
+        res = self.client.delete(delete_url, retry=False)
         log.debug("%s: delete '%s' - code: %s, text: %s", self.name, delete_url, res.status_code, res.text)
 
+    def _train(self, path):
+        # uploads training data file and trains the predictor on it.
+        # an existing predictor keeps serving until a new one is trained under a temporary name,
+        # then it's replaced, so StreamController using it picks up the new version by name
+        if self._is_predictor_exist():
+            datetime_suffix = time.strftime("%Y-%m-%d_%H-%M-%S", time.gmtime())
+            predictor_name = f"TMP_{self.predictor}_{datetime_suffix}"
+        else:
+            predictor_name = self.predictor
+
+        self._upload_file(path)
+        self.learning_params['integration'] = 'files'
+        self.learning_params['query'] = f'select * from {self.training_ds_name}'
+        if 'kwargs' not in self.learning_params:
+            self.learning_params['kwargs'] = {}
+        self.learning_params['kwargs']['join_learn_process'] = True
+        url = f'{self.mindsdb_api_root}/predictors/{predictor_name}'
+        # training is joined, so the request lasts as long as the training, it's never sent again
+        res = self.client.put(url, json=self.learning_params, timeout=None, retry=False)
+        res.raise_for_status()
+
+        if predictor_name != self.predictor:
+            delete_url = f'{self.mindsdb_api_root}/predictors/{self.predictor}'
+            rename_url = f'{self.mindsdb_api_root}/predictors/{predictor_name}/rename?new_name={self.predictor}'
+            res = self.client.delete(delete_url, retry=False)
+            res.raise_for_status()
+            res = self.client.get(rename_url, retry=False)
+            res.raise_for_status()
+
     def _learn_model(self):
         msg = {"action": "training", "predictor": self.predictor,
                "status": "", "details": ""}
 
         try:
-            if self._is_predictor_exist():
-                datetime_suffix = time.strftime("%Y-%m-%d_%H-%M-%S", time.gmtime())
-                predictor_name = f"TMP_{self.predictor}_{datetime_suffix}"
-            else:
-                predictor_name = self.predictor
-
-            df = self._collect_training_data()
-            self._upload_file(df)
-            self.learning_params['integration'] = 'files'
-            self.learning_params['query'] = f'select * from {self.training_ds_name}'
-            if 'kwargs' not in self.learning_params:
-                self.learning_params['kwargs'] = {}
-            self.learning_params['kwargs']['join_learn_process'] = True
-            url = f'{self.mindsdb_api_root}/predictors/{predictor_name}'
-            res = requests.put(url, json=self.learning_params)
-            res.raise_for_status()
-
-            if predictor_name != self.predictor:
-                delete_url = f'{self.mindsdb_api_root}/predictors/{self.predictor}'
-                rename_url = f'{self.mindsdb_api_root}/predictors/{predictor_name}/rename?new_name={self.predictor}'
-                res = requests.delete(delete_url)
-                res.raise_for_status()
-                res = requests.get(rename_url)
-                res.raise_for_status()
+            spool = self._collect_training_data()
+            try:
+                if self.stop_event.is_set():
+                    log.info("%s: stopped while collecting training data, nothing is trained", self.name)
+                    return
+                self._train(spool.to_file(self.upload_format))
+            finally:
+                spool.close()
             msg["status"] = "success"
         except Exception:
             msg["status"] = "error"
             msg["details"] = traceback.format_exc()
         self.stream_out.write(msg)
+        self.stream_out.flush()
 
         # Need to delete its own record from db to mark it as outdated
         # for integration, which will delete it from 'active threads' after that (local installation)
         # for pod_manager, which will delete this pod from kubernetes cluster (cloud)
         self._cleanup()
+
+    def _collect_continuously(self, window, detector, lock):
+        while not self.stop_event.is_set():
+            records = self.stream_in.read_batch(timeout=0.2)
+            if not records:
+                continue
+            with lock:
+                window.add_many(records)
+            if detector is not None:
+                detector.add_many(records)
+            self.stream_in.ack()
+
+    def _learn_continuously(self):
+        # retraining params:
+        #   interval - seconds between scheduled retrains, the first training happens after learning_threshold
+        #   window_rows, window_seconds - size of the rolling training window, by records count and/or age,
+        #     collection max_rows (100000 by default) records when neither is given
+        #   segment_rows - the window is trimmed by segments of this many records, a tenth of window_rows by default
+        #   min_records - skip a retrain if the window has fewer records
+        #   drift_threshold - retrain early when the mean of a numeric column moved more than
+        #     this many standard deviations of the data the current predictor was trained on
+        #   drift_min_records, drift_columns - records needed to check drift, columns to check
+        params = self.retraining_params
+        interval = params.get('interval', self.learning_threshold)
+        min_records = params.get('min_records', 1)
+        window_rows = params.get('window_rows')
+        if window_rows is None and params.get('window_seconds') is None:
+            window_rows = self.collection_params.get('max_rows') or 100000
+        window = RollingSpool(window_rows=window_rows,
+                              window_seconds=params.get('window_seconds'),
+                              segment_rows=params.get('segment_rows'),
+                              chunk_size=self.collection_params.get('chunk_size', 1000))
+        detector = None
+        if params.get('drift_threshold') is not None:
+            detector = MeanShiftDetector(threshold=params['drift_threshold'],
+                                         min_records=params.get('drift_min_records', 100),
+                                         columns=params.get('drift_columns'))
+        lock = Lock()
+        reader = Thread(target=self._collect_continuously, args=(window, detector, lock))
+        reader.start()
+
+        next_training = time.time() + self.learning_threshold
+        try:
+            while not self.stop_event.wait(0.5):
+                drift = detector.score() if detector is not None else 0
+                if detector is not None and drift > detector.threshold:
+                    trigger = 'drift'
+                elif time.time() >= next_training:
+                    trigger = 'schedule'
+                else:
+                    continue
+                next_training = time.time() + interval
+                with lock:
+                    records = len(window)
+                    if records < min_records:
+                        log.info("%s: %s training records, skipping retraining", self.name, records)
+                        # the shift is accepted, otherwise it triggers again on every check
+                        if detector is not None:
+                            detector.reset()
+                        continue
+                    path = window.to_file(self.upload_format)
+                log.info("%s: retraining on %s records, trigger: %s, drift: %s", self.name, records, trigger, drift)
+                self._retrain(path, {"trigger": trigger, "records": records})
+                if detector is not None:
+                    detector.reset()
+        finally:
+            self.stop_event.set()
+            reader.join()
+            window.close()
+
+    def _retrain(self, path, details):
+        msg = {"action": "training", "predictor": self.predictor,
+               "status": "", "details": ""}
+        msg.update(details)
+        previous_ds_name = self.training_ds_name
+        self.training_ds_name = self._new_training_ds_name()
+        try:
+            self._train(path)
+            msg["status"] = "success"
+        except Exception:
+            msg["status"] = "error"
+            msg["details"] = traceback.format_exc()
+        else:
+            # training data of the replaced predictor isn't needed anymore
+            if previous_ds_name != self.training_ds_name:
+                res = self.client.delete(f'{self.mindsdb_api_root}/files/{previous_ds_name}', retry=False)
+                log.debug("%s: delete training data '%s' - code: %s", self.name, previous_ds_name, res.status_code)
+        finally:
+            os.remove(path)
+        self.stream_out.write(msg)
+        self.stream_out.flush()
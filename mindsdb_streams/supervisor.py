@@ -0,0 +1,318 @@
+import os
+import json
+import time
+import heapq
+from copy import deepcopy
+from itertools import count
+from threading import Event, Thread, Condition
+
+from .stream_controller import StreamController, StreamLearningController
+from .utils import log, METRICS
+from .utils.metrics import start_http_server
+
+
+# spec keys which aren't passed to the controller
+SPEC_KEYS = ('name', 'type', 'connection_info', 'predictor', 'input_stream', 'output_stream', 'anomaly_stream',
+             'learning_params', 'learning_threshold')
+
+
+class StreamFactory:
+    # creates streams sharing one redis client or kafka producer per connection_info
+    def __init__(self):
+        self.clients = {}
+
+    def create(self, stream_type, stream, connection_info, mode='rw'):
+        key = (stream_type, json.dumps(connection_info, sort_keys=True, default=str))
+        shared = self.clients.get(key)
+        # only the client library of the used stream type is imported
+        if stream_type == 'redis':
+            from .redis_stream import RedisStream
+            result = RedisStream(stream, connection_info, client=shared)
+            self.clients.setdefault(key, result.client)
+        elif stream_type == 'kafka':
+            from .kafka_stream import KafkaStream
+            result = KafkaStream(stream, connection_info, mode=mode, producer=shared if 'w' in mode else None)
+            if shared is None and result.producer is not None:
+                # the producer now belongs to the factory
+                result._own_producer = False
+                self.clients[key] = result.producer
+        elif stream_type == 'file':
+            from .file_stream import FileStream
+            connection_info = dict(connection_info)
+            result = FileStream(os.path.join(connection_info.pop('path', '.'), stream), **connection_info)
+        else:
+            raise Exception(f"unknown stream type '{stream_type}', expected kafka, redis or file")
+        return result
+
+
+class StreamSupervisor:
+    # runs many stream controllers in one process.
+    # controllers share one http connection pool and redis clients / kafka producers.
+    # regular and time-series controllers don't get threads of their own: 'workers' threads call
+    # controller.step() for controllers which are due, a controller which read nothing is polled
+    # again after a delay doubling up to max_idle_delay seconds, so idle streams cost almost nothing.
+    # pipeline and learning controllers run in their own threads.
+    #
+    # a stream spec is a dict like make_stream.py arguments:
+    #   {"name": ..., "type": "kafka" | "redis" | "file", "connection_info": {...}, "predictor": ...,
+    #    "input_stream": ..., "output_stream": ..., "anomaly_stream": ...,
+    #    "learning_params": ..., "learning_threshold": ..., <StreamController arguments>}
+    # specs are added and removed with add()/remove(), or from config_path json file
+    # {"streams": [spec, ...]} which is re-applied when it changes (checked every reload_interval seconds),
+    # or through the control api, see serve()
+    def __init__(self, name='supervisor', config_path=None, workers=4, max_idle_delay=1, reload_interval=5,
+                 http_params=None, in_thread=False):
+        self.name = name
+        self.config_path = config_path
+        self.workers = workers
+        self.max_idle_delay = max_idle_delay
+        self.reload_interval = reload_interval
+        self.http_params = http_params
+        self.client = None
+        self.stream_factory = StreamFactory()
+        self.specs = {}
+        self.controllers = {}
+        self.threads = {}
+        # (due time, seq, name, controller, idle delay) of controllers waiting for a worker
+        self._schedule = []
+        self._seq = count()
+        self._running = set()
+        self._cond = Condition()
+        self._config_mtime = None
+        self._server = None
+        self.stop_event = Event()
+        METRICS.gauge('supervisor_streams', 'streams run by the supervisor',
+                      supervisor=self.name).set_function(lambda: len(self.controllers))
+
+        if in_thread:
+            self.thread = Thread(target=StreamSupervisor.work, args=(self,))
+            self.thread.start()
+
+    def _create_controller(self, spec):
+        spec = deepcopy(spec)
+        stream_type = spec.get('type', 'kafka')
+        connection_info = spec['connection_info']
+        if isinstance(connection_info, str):
+            connection_info = json.loads(connection_info)
+        kwargs = {k: v for k, v in spec.items() if k not in SPEC_KEYS}
+        kwargs.setdefault('http_params', self.http_params)
+        stream_in = self.stream_factory.create(stream_type, spec['input_stream'], connection_info, mode='r')
+        stream_out = self.stream_factory.create(stream_type, spec['output_stream'], connection_info, mode='w')
+        if spec.get('learning_params') and spec.get('learning_threshold'):
+            return StreamLearningController(spec['name'], spec['predictor'], spec['learning_params'],
+                                            spec['learning_threshold'], stream_in, stream_out,
+                                            client=self.client, **kwargs)
+        stream_anomaly = None
+        if spec.get('anomaly_stream') not in ('', None, 'None', 'none'):
+            stream_anomaly = self.stream_factory.create(stream_type, spec['anomaly_stream'], connection_info, mode='w')
+        # stepped controllers must not block on empty input
+        if not kwargs.get('pipeline_workers'):
+            kwargs.setdefault('poll_timeout', 0)
+        return StreamController(spec['name'], spec['predictor'], stream_in, stream_out, stream_anomaly,
+                                client=self.client, **kwargs)
+
+    def add(self, spec):
+        name = spec['name']
+        if name in self.specs:
+            self.remove(name)
+        controller = self._create_controller(spec)
+        stepped = isinstance(controller, StreamController) and not controller.pipeline_workers
+        if stepped:
+            # a stream which can't be opened isn't registered, so it's tried again with the next apply()
+            try:
+                controller.open()
+            except Exception:
+                controller.close()
+                controller.metrics.unregister(controller=controller.name)
+                raise
+        # all controllers share the connection pool of the first one
+        if self.client is None:
+            self.client = controller.client
+        with self._cond:
+            self.specs[name] = deepcopy(spec)
+            self.controllers[name] = controller
+            if stepped:
+                self._push(0, name, controller, 0)
+            else:
+                self.threads[name] = Thread(target=controller.work, name=name)
+                self.threads[name].start()
+        log.info("%s: added stream %s", self.name, name)
+
+    def remove(self, name):
+        with self._cond:
+            self.specs.pop(name, None)
+            controller = self.controllers.pop(name, None)
+            thread = self.threads.pop(name, None)
+            # a controller being stepped right now is closed by its worker
+            close = isinstance(controller, StreamController) and id(controller) not in self._running
+        if controller is None:
+            return
+        controller.stop_event.set()
+        if thread is not None:
+            thread.join()
+        if close:
+            controller.close()
+        # a stream added again under the same name starts with new metrics
+        if isinstance(controller, StreamController):
+            controller.metrics.unregister(controller=controller.name)
+        log.info("%s: removed stream %s", self.name, name)
+
+    def apply(self, specs):
+        # makes the set of running streams match specs, changed streams are restarted,
+        # returns the names of streams which failed to start
+        failed = []
+        specs = {spec['name']: spec for spec in specs}
+        for name in list(self.specs):
+            if name not in specs or specs[name] != self.specs[name]:
+                self.remove(name)
+        for name, spec in specs.items():
+            if name not in self.specs:
+                try:
+                    self.add(spec)
+                except Exception as e:
+                    log.error("%s: unable to start stream %s - %s", self.name, name, e)
+                    failed.append(name)
+        return failed
+
+    def _reload_config(self):
+        if self.config_path is None:
+            return
+        try:
+            mtime = os.path.getmtime(self.config_path)
+            if mtime == self._config_mtime:
+                return
+            with open(self.config_path) as f:
+                config = json.load(f)
+            self._config_mtime = mtime
+        except Exception as e:
+            log.error("%s: unable to read config %s - %s", self.name, self.config_path, e)
+            return
+        log.info("%s: applying config %s", self.name, self.config_path)
+        if self.apply(config.get('streams', [])):
+            # streams which failed to start are tried again with the next reload
+            self._config_mtime = None
+
+    def _push(self, due, name, controller, delay):
+        heapq.heappush(self._schedule, (due, next(self._seq), name, controller, delay))
+        self._cond.notify()
+
+    def _next_controller(self):
+        # waits for a due controller, returns None when stopped
+        with self._cond:
+            while not self.stop_event.is_set():
+                now = time.time()
+                if self._schedule and self._schedule[0][0] <= now:
+                    _, _, name, controller, delay = heapq.heappop(self._schedule)
+                    if self.controllers.get(name) is not controller:
+                        # removed while waiting
+                        continue
+                    self._running.add(id(controller))
+                    return name, controller, delay
+                timeout = self._schedule[0][0] - now if self._schedule else 1
+                self._cond.wait(timeout)
+        return None
+
+    def _worker(self):
+        while True:
+            item = self._next_controller()
+            if item is None:
+                return
+            name, controller, delay = item
+            try:
+                read = controller.step()
+            except Exception as e:
+                log.error("%s: stream %s error - %s", self.name, name, e)
+                read = 0
+                delay = self.max_idle_delay
+            with self._cond:
+                self._running.discard(id(controller))
+                removed = self.controllers.get(name) is not controller
+                if not removed:
+                    delay = 0 if read else min(max(delay * 2, 0.01), self.max_idle_delay)
+                    self._push(time.time() + delay, name, controller, delay)
+            if removed:
+                controller.close()
+
+    def serve(self, port, host='127.0.0.1'):
+        # control api:
+        #   GET /streams - specs of running streams
+        #   PUT /streams/<name> - starts (or restarts) a stream, body is its spec
+        #   DELETE /streams/<name> - stops a stream
+        #   GET /metrics - prometheus metrics
+        # changes are kept until the config file changes
+        from http.server import BaseHTTPRequestHandler
+        supervisor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, code, body, content_type='application/json'):
+                if content_type == 'application/json':
+                    body = json.dumps(body)
+                body = body.encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _stream_name(self):
+                parts = self.path.strip('/').split('/')
+                if len(parts) == 2 and parts[0] == 'streams':
+                    return parts[1]
+                return None
+
+            def do_GET(self):
+                if self.path.rstrip('/') == '/streams':
+                    self._send(200, list(supervisor.specs.values()))
+                elif self.path.rstrip('/') == '/metrics':
+                    self._send(200, METRICS.render(), content_type='text/plain; version=0.0.4')
+                else:
+                    self._send(404, {'error': 'not found'})
+
+            def do_PUT(self):
+                name = self._stream_name()
+                if name is None:
+                    self._send(404, {'error': 'not found'})
+                    return
+                try:
+                    spec = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)))
+                    spec['name'] = name
+                    supervisor.add(spec)
+                except Exception as e:
+                    self._send(400, {'error': str(e)})
+                    return
+                self._send(200, spec)
+
+            def do_DELETE(self):
+                name = self._stream_name()
+                if name is None or name not in supervisor.specs:
+                    self._send(404, {'error': 'not found'})
+                    return
+                supervisor.remove(name)
+                self._send(200, {'name': name})
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = start_http_server(host, port, Handler)
+        log.info("%s: control api on %s:%s", self.name, host, self._server.server_address[1])
+        return self._server
+
+    def work(self):
+        workers = [Thread(target=self._worker, name=f'{self.name}-worker-{i}') for i in range(self.workers)]
+        for worker in workers:
+            worker.start()
+        try:
+            self._reload_config()
+            while not self.stop_event.wait(self.reload_interval):
+                self._reload_config()
+        finally:
+            self.stop_event.set()
+            with self._cond:
+                self._cond.notify_all()
+            for worker in workers:
+                worker.join()
+            for name in list(self.specs):
+                self.remove(name)
+            if self._server is not None:
+                self._server.shutdown()
+                self._server.server_close()
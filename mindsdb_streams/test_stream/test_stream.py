@@ -1,26 +1,51 @@
 import os
-import json
+import struct
 
 from ..base import BaseStream
+from ..utils import get_codec
 
 
 class TestStream(BaseStream):
-    def __init__(self, filename):
+    def __init__(self, filename, codec=None):
         self.filename = filename
+        self.codec = get_codec(codec)
+
+    def _records(self, f):
+        # text codecs store one record per line,
+        # binary codecs prefix every record with its length
+        if not self.codec.binary:
+            for line in f:
+                yield self.codec.decode(line.rstrip(b'\n'))
+            return
+        while True:
+            header = f.read(4)
+            if len(header) < 4:
+                return
+            size, = struct.unpack('>I', header)
+            yield self.codec.decode(f.read(size))
 
     def read(self):
         if not os.path.exists(self.filename):
             return
-        with open(self.filename, 'r') as f:
-            for line in f:
-                yield json.loads(line.rstrip())
+        with open(self.filename, 'rb') as f:
+            for record in self._records(f):
+                yield record
         with open(self.filename, 'w') as _:
             pass
 
     def write(self, dct):
-        with open(self.filename, 'a') as f:
-            f.write(json.dumps(dct))
-            f.write('\n')
+        self.write_many([dct])
+
+    def write_many(self, records):
+        with open(self.filename, 'ab') as f:
+            for dct in records:
+                data = self.codec.encode(dct)
+                if self.codec.binary:
+                    f.write(struct.pack('>I', len(data)))
+                    f.write(data)
+                else:
+                    f.write(data)
+                    f.write(b'\n')
             f.flush()
 
     def __del__(self):
@@ -11,3 +11,10 @@ if log.level == logging.NOTSET:
     log.addHandler(console_handler)
 
 from .cache import Cache
+from .http_client import PredictionClient, AsyncPredictionClient
+from .window_store import WindowStore
+from .codec import get_codec
+from .prediction_cache import PredictionCache
+from .drift import MeanShiftDetector
+from .spool import TrainingSpool, RollingSpool, FORMATS as TRAINING_DATA_FORMATS
+from .metrics import Metrics, METRICS
@@ -3,7 +3,7 @@ import shelve
 import json
 from abc import ABC, abstractmethod
 
-import walrus
+from .codec import get_codec
 
 
 class BaseCache(ABC):
@@ -39,6 +39,13 @@ class BaseCache(ABC):
     def __setitem__(self, key, value):
         pass
 
+    def get_many(self, keys):
+        # returns dict with values of the keys which exist in the cache
+        return {key: self[key] for key in keys if key in self}
+
+    def set_many(self, mapping):
+        for key, value in mapping.items():
+            self[key] = value
 
 
 class LocalCache(BaseCache):
@@ -60,7 +67,8 @@ class LocalCache(BaseCache):
     def __enter__(self):
         if self.cache is None:
             self.cache = shelve.open(self.cache_file, **self.kwargs)
-        return self.cache.__enter__()
+        self.cache.__enter__()
+        return self
 
     def __exit__(self, _type, value, traceback):
         if self.cache is None:
@@ -86,50 +94,76 @@ class RedisCache(BaseCache):
         self.prefix = prefix
         if self.config["cache"]["type"] != "redis":
             raise Exception(f"wrong cache type in config. expected 'redis', but got {self.config['cache']['type']}.")
-        connection_info = self.config["cache"]["params"]
+        connection_info = dict(self.config["cache"]["params"])
+        self.codec = get_codec(connection_info.pop('codec', None))
+        import walrus
         self.client = walrus.Database(**connection_info)
 
-    def __decode(self, data):
+    def _key(self, key):
+        return f"{self.prefix}_{key}"
+
+    def _load(self, raw):
+        try:
+            return self.codec.decode(raw)
+        except ValueError:
+            return raw.decode('utf8')
 
-        if isinstance(data, dict):
-            return dict((self.__decode(x), self.__decode(data[x])) for x in data)
-        if isinstance(data, list):
-            return list(self.__decode(x) for x in data)
-        # assume it is string
-        return data.decode("utf8")
+    def _scan(self):
+        # SCAN instead of KEYS: doesn't block a shared redis and only returns keys of this cache
+        prefix = self._key('')
+        for key in self.client.scan_iter(match=f"{prefix}*", count=1000):
+            key = key.decode('utf8') if isinstance(key, bytes) else key
+            yield key[len(prefix):]
 
     def __contains__(self, key):
-        key = f"{self.prefix}_{key}"
-        return key in self.__decode(self.client.keys())
+        return self.client.exists(self._key(key)) > 0
 
     def __getitem__(self, key):
-        key = f"{self.prefix}_{key}"
-        raw = self.client.get(key)
+        raw = self.client.get(self._key(key))
         if raw is None:
-            raise KeyError(key)
-        try:
-            res = json.loads(raw)
-        except json.JSONDecodeError:
-            res = raw.decode('utf8')
-        return res
+            raise KeyError(self._key(key))
+        return self._load(raw)
 
     def __setitem__(self, key, value):
-        key = f"{self.prefix}_{key}"
-        self.client.set(key, json.dumps(value))
+        self.client.set(self._key(key), self.codec.encode(value))
 
-    def __iter__(self):
-        return iter(self.__decode(self.client.keys()))
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self.client.mget([self._key(key) for key in keys])
+        return {key: self._load(raw) for key, raw in zip(keys, values) if raw is not None}
 
-    def __next__(self):
-        for i in self.__decode(self.client.keys()):
-            yield i
+    def set_many(self, mapping):
+        if not mapping:
+            return
+        self.client.mset({self._key(key): self.codec.encode(value) for key, value in mapping.items()})
 
-    def __delitem__(self, key):
-        key = f"{self.prefix}_key"
-        self.client.delete(key)
+    def __enter__(self):
+        return self
 
-    def delete(self):
-        pass
+    def __exit__(self, _type, value, traceback):
+        return None
+
+    def keys(self):
+        return list(self._scan())
 
+    def __iter__(self):
+        return self._scan()
+
+    def __delitem__(self, key):
+        self.client.delete(self._key(key))
 
-Cache = RedisCache if BaseCache.redis_cache_connection else LocalCache
+    def delete(self):
+        pipe = self.client.pipeline(transaction=False)
+        for key in self._scan():
+            pipe.delete(self._key(key))
+        pipe.execute()
+
+
+def Cache(name, *args, **kwargs):
+    # the cache type is chosen when a cache is created, not on import,
+    # so REDIS_CACHE may be set after the package is imported
+    if os.getenv("REDIS_CACHE"):
+        return RedisCache(name, *args, **kwargs)
+    return LocalCache(name, *args, **kwargs)
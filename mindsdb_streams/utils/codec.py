@@ -0,0 +1,93 @@
+import json
+
+
+class JsonCodec:
+    binary = False
+
+    def encode(self, obj):
+        return json.dumps(obj).encode('utf-8')
+
+    def decode(self, raw):
+        return json.loads(raw)
+
+
+class OrjsonCodec:
+    binary = False
+
+    def __init__(self):
+        try:
+            import orjson
+        except ImportError:
+            raise ImportError("'orjson' codec requires orjson package to be installed")
+        self.orjson = orjson
+
+    def encode(self, obj):
+        return self.orjson.dumps(obj)
+
+    def decode(self, raw):
+        return self.orjson.loads(raw)
+
+
+class MsgpackCodec:
+    binary = True
+
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError:
+            raise ImportError("'msgpack' codec requires msgpack package to be installed")
+        self.msgpack = msgpack
+
+    def encode(self, obj):
+        return self.msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, raw):
+        return self.msgpack.unpackb(raw, raw=False)
+
+
+class SchemaCodec:
+    # compact format for flat records with a known set of fields:
+    # a record is sent as a list of values in 'fields' order,
+    # keys which are not in 'fields' are appended as a dict.
+    # intended for stream messages, not for cache values
+    def __init__(self, fields, format='msgpack'):
+        self.fields = list(fields)
+        self.base = get_codec(format)
+        self.binary = self.base.binary
+
+    def encode(self, dct):
+        row = [dct.get(field) for field in self.fields]
+        extra = {k: v for k, v in dct.items() if k not in self.fields}
+        if extra:
+            row.append(extra)
+        return self.base.encode(row)
+
+    def decode(self, raw):
+        row = self.base.decode(raw)
+        dct = dict(zip(self.fields, row))
+        if len(row) > len(self.fields):
+            dct.update(row[-1])
+        return dct
+
+
+codecs = {
+    'json': JsonCodec,
+    'orjson': OrjsonCodec,
+    'msgpack': MsgpackCodec,
+}
+
+
+def get_codec(codec_info=None):
+    # codec_info is a codec name, or a dict like
+    # {"type": "schema", "fields": ["x1", "x2"], "format": "msgpack"}
+    if codec_info is None:
+        return JsonCodec()
+    if isinstance(codec_info, dict):
+        codec_info = dict(codec_info)
+        codec_type = codec_info.pop('type', 'json')
+        if codec_type == 'schema':
+            return SchemaCodec(**codec_info)
+        codec_info = codec_type
+    if codec_info not in codecs:
+        raise Exception(f"unknown codec '{codec_info}', expected one of: {', '.join([*codecs, 'schema'])}")
+    return codecs[codec_info]()
@@ -0,0 +1,69 @@
+import math
+from threading import Lock
+
+
+class _RunningStats:
+    # Welford's online mean/variance
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+
+class MeanShiftDetector:
+    # detects drift of numeric columns: a column drifts when the mean of records seen
+    # since the last reset moved more than threshold standard deviations of the reference records.
+    # reference is what the current model was trained on, reset() makes current records the reference
+    def __init__(self, threshold=3.0, min_records=100, columns=None):
+        self.threshold = threshold
+        self.min_records = min_records
+        self.columns = columns
+        self.reference = {}
+        self.current = {}
+        self._lock = Lock()
+
+    def add_many(self, records):
+        with self._lock:
+            for record in records:
+                for column, value in record.items():
+                    if self.columns is not None and column not in self.columns:
+                        continue
+                    if isinstance(value, bool) or not isinstance(value, (int, float)):
+                        continue
+                    if column not in self.current:
+                        self.current[column] = _RunningStats()
+                    self.current[column].add(value)
+
+    def score(self):
+        # biggest shift among columns, in reference standard deviations
+        with self._lock:
+            result = 0.0
+            for column, ref in self.reference.items():
+                cur = self.current.get(column)
+                if cur is None or cur.count < self.min_records or ref.count < self.min_records:
+                    continue
+                shift = abs(cur.mean - ref.mean)
+                std = ref.std
+                if std == 0:
+                    result = max(result, math.inf if shift else 0.0)
+                else:
+                    result = max(result, shift / std)
+            return result
+
+    def is_drifted(self):
+        return self.score() > self.threshold
+
+    def reset(self):
+        with self._lock:
+            self.reference = self.current
+            self.current = {}
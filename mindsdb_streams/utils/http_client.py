@@ -0,0 +1,148 @@
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class MultipartFile:
+    # file-like multipart/form-data body with a single file field,
+    # read by requests in chunks, so the file is never loaded in memory
+    def __init__(self, path, field='file', filename=None, content_type='application/octet-stream'):
+        self.boundary = uuid.uuid4().hex
+        filename = filename or os.path.basename(path)
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        self.parts = [
+            (f'--{self.boundary}\r\n'
+             f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+             f'Content-Type: {content_type}\r\n\r\n').encode('utf-8'),
+            path,
+            f'\r\n--{self.boundary}--\r\n'.encode('utf-8'),
+        ]
+        self.len = len(self.parts[0]) + os.path.getsize(path) + len(self.parts[2])
+        self._file = None
+        self._part = 0
+        self._offset = 0
+
+    def read(self, size=-1):
+        chunks = []
+        while self._part < len(self.parts) and size != 0:
+            part = self.parts[self._part]
+            if isinstance(part, bytes):
+                end = len(part) if size < 0 else self._offset + size
+                chunk = part[self._offset:end]
+                self._offset += len(chunk)
+                if self._offset >= len(part):
+                    self._part += 1
+                    self._offset = 0
+            else:
+                if self._file is None:
+                    self._file = open(part, 'rb')
+                chunk = self._file.read(size)
+                if not chunk or (size > 0 and len(chunk) < size):
+                    self._file.close()
+                    self._part += 1
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b''.join(chunks)
+
+    def __len__(self):
+        return self.len
+
+
+class PredictionClient:
+    # keep-alive session with a bounded connection pool,
+    # default timeouts and retries with exponential backoff
+    # for the calls made by controllers to MindsDB http api,
+    # upload_timeout is (connect, read) timeout of training data uploads
+    def __init__(self, headers=None, pool_size=10, timeout=(10, 60), retries=3, backoff_factor=0.5,
+                 upload_timeout=(10, 600)):
+        self.headers = headers or {}
+        self.timeout = timeout
+        # json params give a list
+        self.upload_timeout = tuple(upload_timeout) if isinstance(upload_timeout, list) else upload_timeout
+        # predict requests and reads are retried on errors and gateway statuses,
+        # calls made with retry=False (training, deleting, renaming predictors) only when they can't connect
+        retry = Retry(total=retries,
+                      backoff_factor=backoff_factor,
+                      status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset(['GET', 'POST']),
+                      raise_on_status=False)
+        self.session = self._session(pool_size, retry)
+        self.once_session = self._session(pool_size, Retry(total=retries, read=0, status=0,
+                                                           backoff_factor=backoff_factor, raise_on_status=False))
+
+    @staticmethod
+    def _session(pool_size, retry):
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def request(self, method, url, retry=True, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        headers = {**self.headers, **kwargs.get('headers', {})}
+        if 'files' in kwargs:
+            # requests sets multipart content type itself
+            headers.pop('Content-Type', None)
+        kwargs['headers'] = headers
+        session = self.session if retry else self.once_session
+        return session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def upload_file(self, url, path, filename=None, content_type='text/csv', timeout=None):
+        # streams the file as multipart body. the session isn't used, because
+        # its retries would resend an already consumed body
+        body = MultipartFile(path, filename=filename, content_type=content_type)
+        headers = {**self.headers, 'Content-Type': body.content_type}
+        return requests.put(url, data=body, headers=headers, timeout=timeout or self.upload_timeout)
+
+    def predict(self, url, when_data):
+        params = {"when": when_data, 'format_flag': 'dict'}
+        res = self.post(url, json=params)
+        if res.status_code != requests.status_codes.codes.ok:
+            raise Exception(f"unable to get prediction for {when_data}: {res.text}")
+        return res.json()
+
+    def close(self):
+        self.session.close()
+        self.once_session.close()
+
+
+class AsyncPredictionClient:
+    # runs up to max_in_flight predict requests concurrently in a thread pool
+    # over the pooled session of the wrapped PredictionClient,
+    # predict_func(url, when_data) replaces client.predict, e.g. to measure requests
+    def __init__(self, client, max_in_flight=10, predict_func=None):
+        self.client = client
+        self.max_in_flight = max_in_flight
+        self.predict_func = predict_func or client.predict
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+
+    def predict(self, url, when_data):
+        # returns a concurrent.futures.Future of the prediction
+        return self.executor.submit(self.predict_func, url, when_data)
+
+    def predict_all(self, url, when_list):
+        # blocks until all requests are done, results are returned in the order of when_list,
+        # a failed request is returned as its exception
+        futures = [self.predict(url, when_data) for when_data in when_list]
+        return [future.exception() or future.result() for future in futures]
+
+    def close(self):
+        self.executor.shutdown(wait=False)
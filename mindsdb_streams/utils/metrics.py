@@ -0,0 +1,247 @@
+import time
+from bisect import bisect_left
+from threading import Lock, Thread, Event
+
+from . import log
+
+# seconds, suitable for both stream operations and predict requests
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    items = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+    return '{' + items + '}'
+
+
+def start_http_server(host, port, handler):
+    # serves handler (a BaseHTTPRequestHandler) in a daemon thread,
+    # http.server is imported only when something is served
+    from socketserver import ThreadingMixIn
+    from http.server import HTTPServer
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    server = Server((host, port), handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self):
+        self.value = 0
+        self._lock = Lock()
+
+    def inc(self, value=1):
+        with self._lock:
+            self.value += value
+
+    def samples(self):
+        return [('', (), self.value)]
+
+
+class Gauge:
+    type = 'gauge'
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        # the value is computed by function when metrics are collected, not on the hot path
+        self.function = function
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                return [('', (), self.function())]
+            except Exception as e:
+                log.debug("metrics: gauge function error - %s", e)
+        return [('', (), self.value)]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # counts[i] - observations in (buckets[i-1], buckets[i]], the last one is +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+    def quantile(self, q):
+        # upper bound of the bucket containing q-th quantile, None without observations
+        with self._lock:
+            counts, total = list(self.counts), self.count
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for bound, n in zip(self.buckets + (float('inf'), ), counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def samples(self):
+        with self._lock:
+            counts, total, total_sum = list(self.counts), self.count, self.sum
+        result = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + ('+Inf', ), counts):
+            cumulative += n
+            result.append(('_bucket', (('le', bound), ), cumulative))
+        result.append(('_count', (), total))
+        result.append(('_sum', (), total_sum))
+        return result
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Metrics:
+    # registry of counters, gauges and histograms identified by name and labels.
+    # metrics are exposed as prometheus text (render, serve) or as a dict passed
+    # to a callback every interval seconds (report)
+    def __init__(self, prefix='mindsdb_streams'):
+        self.prefix = prefix
+        # name -> (type, help, {labels: metric})
+        self.families = {}
+        self._lock = Lock()
+        self._server = None
+        self._reporter_stop = None
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        labels = tuple(sorted(labels.items()))
+        family = self.families.get(name)
+        if family is not None:
+            metric = family[2].get(labels)
+            if metric is not None:
+                return metric
+        with self._lock:
+            family = self.families.setdefault(name, (cls.type, help, {}))
+            if family[0] != cls.type:
+                raise Exception(f"metric '{name}' is already registered as {family[0]}")
+            return family[2].setdefault(labels, cls(**kwargs))
+
+    def counter(self, name, help='', **labels):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help='', **labels):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help='', buckets=DEFAULT_BUCKETS, **labels):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def unregister(self, **labels):
+        # removes every metric having all of labels, e.g. unregister(controller=name) when a controller is removed
+        labels = set(labels.items())
+        with self._lock:
+            for name, (_, _, metrics) in list(self.families.items()):
+                for key in [key for key in metrics if labels <= set(key)]:
+                    del metrics[key]
+                if not metrics:
+                    del self.families[name]
+
+    def _samples(self):
+        with self._lock:
+            families = [(name, t, h, list(metrics.items())) for name, (t, h, metrics) in self.families.items()]
+        for name, metric_type, help, metrics in families:
+            full_name = f'{self.prefix}_{name}' if self.prefix else name
+            yield full_name, metric_type, help, [
+                (full_name + suffix, labels + extra, value)
+                for labels, metric in metrics for suffix, extra, value in metric.samples()
+            ]
+
+    def render(self):
+        lines = []
+        for name, metric_type, help, samples in self._samples():
+            if help:
+                lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for sample_name, labels, value in samples:
+                lines.append(f'{sample_name}{_format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        # {'name{label="value"}': value}
+        return {
+            sample_name + _format_labels(labels): value
+            for _, _, _, samples in self._samples()
+            for sample_name, labels, value in samples
+        }
+
+    def serve(self, port, host='0.0.0.0'):
+        # prometheus text endpoint on http://host:port/metrics
+        from http.server import BaseHTTPRequestHandler
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = start_http_server(host, port, Handler)
+        log.info("metrics: serving on %s:%s", host, self._server.server_address[1])
+        return self._server
+
+    def report(self, callback, interval=10):
+        # calls callback(snapshot) every interval seconds in a background thread
+        self._reporter_stop = Event()
+
+        def loop(stop):
+            while not stop.wait(interval):
+                try:
+                    callback(self.snapshot())
+                except Exception as e:
+                    log.error("metrics: report callback error - %s", e)
+
+        Thread(target=loop, args=(self._reporter_stop, ), daemon=True).start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._reporter_stop is not None:
+            self._reporter_stop.set()
+            self._reporter_stop = None
+
+
+# default registry used by controllers
+METRICS = Metrics()
@@ -0,0 +1,51 @@
+import json
+import time
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+
+
+class PredictionCache:
+    # LRU cache of prediction results keyed by a hash of when_data,
+    # entries expire ttl seconds after they were added
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+    @staticmethod
+    def key(when_data):
+        raw = json.dumps(when_data, sort_keys=True, default=str)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, when_data):
+        # returns None if there is no valid cached result
+        key = self.key(when_data)
+        with self._lock:
+            item = self.items.get(key)
+            if item is None or item[0] < time.time():
+                if item is not None:
+                    del self.items[key]
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, when_data, result):
+        key = self.key(when_data)
+        with self._lock:
+            self.items[key] = (time.time() + self.ttl, result)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.items.clear()
+
+    def __len__(self):
+        return len(self.items)
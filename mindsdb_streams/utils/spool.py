@@ -0,0 +1,265 @@
+import os
+import csv
+import gzip
+import json
+import time
+import random
+from collections import deque
+from itertools import islice
+from tempfile import NamedTemporaryFile
+
+# column types inferred during collection, a column takes the widest type of its values
+DTYPES = ['bool', 'int', 'float', 'str']
+
+# upload format -> (file extension, content type)
+FORMATS = {
+    'csv': ('csv', 'text/csv'),
+    'csv.gz': ('csv.gz', 'application/gzip'),
+    'parquet': ('parquet', 'application/octet-stream'),
+    'arrow': ('arrow', 'application/vnd.apache.arrow.file'),
+}
+
+
+def _dtype(value):
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    return 'str'
+
+
+def _widest(dtype, other):
+    if dtype is None or (other is not None and DTYPES.index(other) > DTYPES.index(dtype)):
+        return other
+    return dtype
+
+
+def _cast(value, dtype):
+    if value is None:
+        return None
+    if dtype == 'str':
+        return value if isinstance(value, str) else json.dumps(value, default=str)
+    if dtype == 'float':
+        return float(value)
+    if dtype == 'int':
+        # bools in an int column
+        return int(value)
+    return value
+
+
+def _write_csv(path, columns, records, compress=False):
+    opener = gzip.open if compress else open
+    with opener(path, 'wt', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(columns), restval='')
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+
+
+def _write_arrow(path, columns, records, chunk_size, parquet=False):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("parquet and arrow training data formats require pyarrow package to be installed")
+    pa_types = {'bool': pa.bool_(), 'int': pa.int64(), 'float': pa.float64(), 'str': pa.string(), None: pa.string()}
+    schema = pa.schema([(column, pa_types[dtype]) for column, dtype in columns.items()])
+    writer = pq.ParquetWriter(path, schema) if parquet else pa.ipc.new_file(path, schema)
+    try:
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                break
+            arrays = [
+                pa.array([_cast(record.get(column), dtype) for record in chunk], type=pa_types[dtype])
+                for column, dtype in columns.items()
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+    finally:
+        writer.close()
+
+
+def write_records(columns, records, format='csv', chunk_size=1000):
+    # writes records to a temporary file of one of FORMATS and returns its path,
+    # columns is a dict column -> dtype
+    if format not in FORMATS:
+        raise Exception(f"unknown training data format '{format}', expected one of: {', '.join(FORMATS)}")
+    with NamedTemporaryFile(suffix='.' + FORMATS[format][0], delete=False) as f:
+        path = f.name
+    if format in ('csv', 'csv.gz'):
+        _write_csv(path, columns, records, compress=format == 'csv.gz')
+    else:
+        _write_arrow(path, columns, iter(records), chunk_size, parquet=format == 'parquet')
+    return path
+
+
+class TrainingSpool:
+    # collects training records on disk instead of memory.
+    # records are appended to a json lines file in chunks of chunk_size,
+    # collection stops when max_rows records or max_bytes bytes are spooled.
+    # with sample_size only a uniform sample (reservoir) of that many
+    # spooled records is exported, only their row numbers are kept in memory
+    def __init__(self, max_rows=None, max_bytes=None, sample_size=None, chunk_size=1000, seed=None):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.sample_size = sample_size
+        self.chunk_size = chunk_size
+        self.random = random.Random(seed)
+        self.sample = [] if sample_size else None
+        # column -> dtype, None while only nulls were seen
+        self.columns = {}
+        self.rows = 0
+        self.bytes = 0
+        self.buffer = []
+        self.file = NamedTemporaryFile(mode='w', suffix='.jsonl', delete=False)
+        self.export_path = None
+
+    @property
+    def is_full(self):
+        if self.max_rows is not None and self.rows >= self.max_rows:
+            return True
+        return self.max_bytes is not None and self.bytes >= self.max_bytes
+
+    def add_many(self, records):
+        for record in records:
+            if self.is_full:
+                break
+            line = json.dumps(record, default=str)
+            for column, value in record.items():
+                self._update_dtype(column, value)
+            if self.sample is not None:
+                self._sample_row(self.rows)
+            self.buffer.append(line)
+            self.rows += 1
+            self.bytes += len(line) + 1
+            if len(self.buffer) >= self.chunk_size:
+                self._flush_buffer()
+
+    def _update_dtype(self, column, value):
+        self.columns[column] = _widest(self.columns.get(column), None if value is None else _dtype(value))
+
+    def _sample_row(self, row):
+        if row < self.sample_size:
+            self.sample.append(row)
+            return
+        i = self.random.randint(0, row)
+        if i < self.sample_size:
+            self.sample[i] = row
+
+    def _flush_buffer(self):
+        if self.buffer:
+            self.file.write('\n'.join(self.buffer))
+            self.file.write('\n')
+            self.buffer = []
+
+    def _records(self):
+        self._flush_buffer()
+        self.file.flush()
+        selected = set(self.sample) if self.sample is not None else None
+        with open(self.file.name, 'r') as f:
+            for row, line in enumerate(f):
+                if selected is None or row in selected:
+                    yield json.loads(line)
+
+    def to_file(self, format='csv'):
+        # writes spooled (or sampled) records to a file of one of FORMATS and returns its path
+        self.export_path = write_records(self.columns, self._records(), format, self.chunk_size)
+        return self.export_path
+
+    def to_csv(self):
+        return self.to_file('csv')
+
+    def close(self):
+        self.file.close()
+        for path in (self.file.name, self.export_path):
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+    def __len__(self):
+        return len(self.sample) if self.sample is not None else self.rows
+
+
+class RollingSpool:
+    # rolling training window made of TrainingSpool segments.
+    # the oldest segment is dropped when the rest of the window still has window_rows records,
+    # or when all its records are older than window_seconds,
+    # so the window is trimmed with segment granularity, at least one of the limits is required
+    def __init__(self, window_rows=None, window_seconds=None, segment_rows=None, segment_seconds=None, chunk_size=1000):
+        if window_rows is None and window_seconds is None:
+            raise Exception("rolling window needs window_rows or window_seconds")
+        self.window_rows = window_rows
+        self.window_seconds = window_seconds
+        if segment_rows is None:
+            segment_rows = max(window_rows // 10, 1) if window_rows else 10000
+        self.segment_rows = segment_rows
+        if segment_seconds is None and window_seconds is not None:
+            segment_seconds = window_seconds / 10
+        self.segment_seconds = segment_seconds
+        self.chunk_size = chunk_size
+        # (creation time, last write time, spool)
+        self.segments = deque()
+        self.export_path = None
+
+    @property
+    def rows(self):
+        return sum(spool.rows for _, _, spool in self.segments)
+
+    def _current(self, now):
+        if self.segments:
+            created, _, spool = self.segments[-1]
+            full = spool.rows >= self.segment_rows
+            expired = self.segment_seconds is not None and now - created >= self.segment_seconds
+            if not full and not expired:
+                return spool
+        spool = TrainingSpool(chunk_size=self.chunk_size)
+        self.segments.append((now, now, spool))
+        return spool
+
+    def add_many(self, records):
+        now = time.time()
+        records = list(records)
+        while records:
+            spool = self._current(now)
+            size = self.segment_rows - spool.rows
+            spool.add_many(records[:size])
+            records = records[size:]
+            created, _, spool = self.segments[-1]
+            self.segments[-1] = (created, now, spool)
+        self._trim(now)
+
+    def _trim(self, now):
+        while len(self.segments) > 1:
+            _, last_write, oldest = self.segments[0]
+            too_many = self.window_rows is not None and self.rows - oldest.rows >= self.window_rows
+            too_old = self.window_seconds is not None and now - last_write > self.window_seconds
+            if not too_many and not too_old:
+                break
+            self.segments.popleft()
+            oldest.close()
+
+    def to_file(self, format='csv'):
+        if self.export_path is not None and os.path.exists(self.export_path):
+            os.remove(self.export_path)
+        self._trim(time.time())
+        columns = {}
+        for _, _, spool in self.segments:
+            for column, dtype in spool.columns.items():
+                columns[column] = _widest(columns.get(column), dtype)
+        records = (record for _, _, spool in self.segments for record in spool._records())
+        self.export_path = write_records(columns, records, format, self.chunk_size)
+        return self.export_path
+
+    def to_csv(self):
+        return self.to_file('csv')
+
+    def close(self):
+        for _, _, spool in self.segments:
+            spool.close()
+        self.segments.clear()
+        if self.export_path is not None and os.path.exists(self.export_path):
+            os.remove(self.export_path)
+
+    def __len__(self):
+        return self.rows
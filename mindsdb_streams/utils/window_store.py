@@ -0,0 +1,193 @@
+import time
+from bisect import insort
+from datetime import datetime
+from itertools import count
+from threading import Event, Lock, Thread
+
+from . import log
+from .cache import Cache
+
+# cache key with the list of stored groups, so restore doesn't need to scan the cache
+INDEX_KEY = '__groups__'
+
+
+def _normalize(value):
+    # numbers and dates are compared by value, anything else as a string.
+    # numeric and date strings are parsed because
+    # some streams (e.g. redis) deliver every field as a string
+    if isinstance(value, (int, float)):
+        return (0, value)
+    if isinstance(value, datetime):
+        return (0, value.timestamp())
+    value = str(value)
+    try:
+        return (0, float(value))
+    except ValueError:
+        pass
+    try:
+        dt = value[:-1] + '+00:00' if value.endswith('Z') else value
+        return (0, datetime.fromisoformat(dt).timestamp())
+    except ValueError:
+        pass
+    return (1, value)
+
+
+class WindowStore:
+    # keeps time-series records per group in memory ordered by order_by columns,
+    # the cache is only a checkpoint used to restore windows after restart.
+    # a window is emitted when a group has window + tolerance records,
+    # so up to 'tolerance' records may arrive out of order. records older than
+    # the last record dropped from the group (watermark) are discarded.
+    # with shared=True several workers use the same cache, each one holding
+    # only the groups it currently owns: groups are loaded with load() and
+    # handed over with release(), the group index isn't kept.
+    # with cached=False windows are kept in memory only, nothing is saved or restored
+    def __init__(self, name, order_by, window, tolerance=0, checkpoint_interval=5, shared=False, cached=True):
+        self.name = name
+        self.order_by = order_by
+        self.window = window
+        self.tolerance = tolerance
+        self.checkpoint_interval = checkpoint_interval
+        self.shared = shared
+        self.cache = Cache(name) if cached else None
+        # gb_value -> sorted list of (order key, arrival number, record)
+        self.groups = {}
+        self.watermarks = {}
+        self._counter = count()
+        self._changed = set()
+        # groups which got new records since the last pop_dirty
+        self._dirty = set()
+        self._index_changed = False
+        self._lock = Lock()
+        self._stop_event = Event()
+        self._thread = None
+        self._last_checkpoint = time.time()
+
+    def order_key(self, record):
+        return tuple(_normalize(record[ob]) for ob in self.order_by)
+
+    def restore(self):
+        if self.cache is None:
+            return
+        with self.cache as cache:
+            if INDEX_KEY in cache:
+                gb_values = cache[INDEX_KEY]
+            else:
+                gb_values = [k for k in cache.keys() if k != INDEX_KEY]
+            for gb_value, records in cache.get_many(gb_values).items():
+                for record in records:
+                    self._insert(gb_value, record)
+            self._dirty.update(self.groups)
+        log.debug("%s: restored %s groups from cache", self.name, len(self.groups))
+
+    def load(self, gb_values):
+        # loads from the cache groups which aren't in memory yet
+        missing = [gb_value for gb_value in gb_values if gb_value not in self.groups]
+        if not missing or self.cache is None:
+            return
+        with self.cache as cache:
+            loaded = cache.get_many(missing)
+        with self._lock:
+            for gb_value, records in loaded.items():
+                for record in records:
+                    self._insert(gb_value, record)
+        log.debug("%s: loaded %s groups from cache", self.name, len(loaded))
+
+    def release(self):
+        # saves all groups to the cache and forgets them
+        with self._lock:
+            self._changed.update(self.groups)
+        self.checkpoint()
+        with self._lock:
+            self.groups = {}
+            self.watermarks = {}
+            self._changed = set()
+            self._dirty = set()
+
+    def start(self, background=True):
+        # without the background thread the owner calls maybe_checkpoint() regularly
+        if background:
+            self._thread = Thread(target=self._checkpoint_loop, daemon=True)
+            self._thread.start()
+
+    def maybe_checkpoint(self):
+        if self._thread is not None or time.time() - self._last_checkpoint < self.checkpoint_interval:
+            return
+        try:
+            self.checkpoint()
+        except Exception as e:
+            log.error("%s: checkpoint error - %s", self.name, e)
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.checkpoint()
+
+    def _checkpoint_loop(self):
+        while not self._stop_event.wait(self.checkpoint_interval):
+            try:
+                self.checkpoint()
+            except Exception as e:
+                log.error("%s: checkpoint error - %s", self.name, e)
+
+    def checkpoint(self):
+        self._last_checkpoint = time.time()
+        with self._lock:
+            changed = {gb_value: [item[2] for item in self.groups[gb_value]] for gb_value in self._changed}
+            self._changed = set()
+            index = list(self.groups) if self._index_changed and not self.shared else None
+            self._index_changed = False
+        if not changed or self.cache is None:
+            return
+        if index is not None:
+            changed[INDEX_KEY] = index
+        with self.cache as cache:
+            cache.set_many(changed)
+        log.debug("%s: saved %s groups to cache", self.name, len(changed))
+
+    def _insert(self, gb_value, record):
+        if gb_value not in self.groups:
+            log.debug("%s: creating window for gb - %s", self.name, gb_value)
+            self.groups[gb_value] = []
+            self._index_changed = True
+        insort(self.groups[gb_value], (self.order_key(record), next(self._counter), record))
+
+    def append(self, gb_value, record):
+        # returns False if the record is behind the group watermark and was dropped
+        watermark = self.watermarks.get(gb_value)
+        if watermark is not None and self.order_key(record) < watermark:
+            log.warning("%s: dropping late record for gb %s - %s", self.name, gb_value, record)
+            return False
+        with self._lock:
+            self._insert(gb_value, record)
+            self._changed.add(gb_value)
+            self._dirty.add(gb_value)
+        return True
+
+    def keys(self):
+        return list(self.groups.keys())
+
+    def pop_dirty(self):
+        # groups which got new records since the previous call
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def size(self, gb_value):
+        return len(self.groups.get(gb_value, ()))
+
+    def windows(self, gb_value):
+        # yields every full window of the group in order,
+        # the oldest record is dropped only after its window has been consumed
+        records = self.groups.get(gb_value)
+        if records is None:
+            return
+        while len(records) >= self.window + self.tolerance:
+            yield [item[2] for item in records[:self.window]]
+            with self._lock:
+                oldest = records.pop(0)
+                self.watermarks[gb_value] = oldest[0]
+                self._changed.add(gb_value)
+
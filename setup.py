@@ -26,9 +26,15 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     packages=setuptools.find_packages(),
     install_requires=requirements,
+    # faster stream codecs and parquet/arrow training data uploads
+    extras_require={
+        'orjson': ['orjson'],
+        'msgpack': ['msgpack'],
+        'arrow': ['pyarrow'],
+    },
     classifiers=(
         "Programming Language :: Python :: 3",
         "Operating System :: OS Independent",
     ),
-    python_requires=">=3.6"
+    python_requires=">=3.7"
 )
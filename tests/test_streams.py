@@ -1,15 +1,19 @@
 import os
+import sys
 import time
 import atexit
 import unittest
 import tempfile
+import shutil
 import threading
 from subprocess import Popen
 
 import psutil
 import requests
 import pandas as pd
-from mindsdb_streams import TestStream, StreamController
+from mindsdb_streams import TestStream, FileStream, QueueStream, StreamController, MultiStreamController, \
+    StreamSupervisor
+from mindsdb_streams.utils import WindowStore, TrainingSpool, RollingSpool, MeanShiftDetector, Metrics, METRICS
 
 
 HTTP_API_ROOT = "http://127.0.0.1:47334/api"
@@ -139,6 +143,41 @@ class StreamTest(unittest.TestCase):
 
         self.assertEqual(len(list(stream_out.read())), 2)
 
+    def test_2a_batch_predictions_through_controller(self):
+        print(f"\nExecuting {self._testMethodName}")
+        stream_in = TestStream(f'{self._testMethodName}_in')
+        stream_out = TestStream(f'{self._testMethodName}_out')
+        controller = StreamController(DEFAULT_STREAM_NAME, DEFAULT_PREDICTOR, stream_in, stream_out,
+                                      batch_size=4, max_in_flight=2)
+        controller_thread = threading.Thread(target=controller.work, args=())
+
+        for x in range(1, 11):
+            stream_in.write({'x1': x, 'x2': 2*x})
+
+        controller_thread.start()
+        time.sleep(2)
+        controller.stop_event.set()
+
+        self.assertEqual(len(list(stream_out.read())), 10)
+
+    def test_2b_pipeline_predictions_through_controller(self):
+        print(f"\nExecuting {self._testMethodName}")
+        stream_in = TestStream(f'{self._testMethodName}_in')
+        stream_out = TestStream(f'{self._testMethodName}_out')
+        controller = StreamController(DEFAULT_STREAM_NAME, DEFAULT_PREDICTOR, stream_in, stream_out,
+                                      pipeline_workers=3)
+        controller_thread = threading.Thread(target=controller.work, args=())
+
+        for x in range(1, 11):
+            stream_in.write({'x1': x, 'x2': 2*x})
+
+        controller_thread.start()
+        time.sleep(2)
+        controller.stop_event.set()
+        controller_thread.join()
+
+        self.assertEqual(len(list(stream_out.read())), 10)
+
     def test_3_ts_predictions_through_controller(self):
         print(f"\nExecuting {self._testMethodName}")
         self.train_ts_predictor(DS_NAME, TS_PREDICTOR)
@@ -156,6 +195,18 @@ class StreamTest(unittest.TestCase):
         controller.stop_event.set()
         self.assertEqual(len(list(stream_out.read())), 2)
 
+    def test_3a_ts_backfill_through_controller(self):
+        print(f"\nExecuting {self._testMethodName}")
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+        stream_in = FileStream(path)
+        stream_in.write_many([{'x1': x, 'x2': 2*x, 'order': x, 'group': "A"} for x in range(200, 221)])
+        stream_out = TestStream(f'{self._testMethodName}_out')
+        controller = StreamController(TS_STREAM_NAME, TS_PREDICTOR, stream_in, stream_out)
+
+        self.assertEqual(controller.backfill(10, batch_size=5), 11)
+        self.assertEqual(len(list(stream_out.read())), 2)
+
     def test_4_ts_predictions_through_controller_no_group(self):
         print(f"\nExecuting {self._testMethodName}")
         PREDICTOR_NAME = TS_PREDICTOR + "_no_group"
@@ -175,6 +226,360 @@ class StreamTest(unittest.TestCase):
         self.assertEqual(len(list(stream_out.read())), 2)
 
 
+class CodecTest(unittest.TestCase):
+    def test_test_stream_codecs(self):
+        print(f"\nExecuting {self._testMethodName}")
+        records = [{'x1': 1, 'x2': 'a'}, {'x1': 2, 'x2': None, 'x3': [1, 2]}]
+        codecs = ['json', {'type': 'schema', 'fields': ['x1', 'x2'], 'format': 'json'}]
+        for codec in codecs:
+            stream = TestStream(f'{self._testMethodName}_{len(str(codec))}', codec=codec)
+            for record in records:
+                stream.write(record)
+            self.assertEqual(list(stream.read()), records)
+            self.assertEqual(list(stream.read()), [])
+
+
+class FileStreamTest(unittest.TestCase):
+    def test_segments_and_offsets(self):
+        print(f"\nExecuting {self._testMethodName}")
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+        writer = FileStream(path, segment_bytes=500)
+        writer.write_many([{'x1': x} for x in range(100)])
+        self.assertGreater(len(os.listdir(path)), 1)
+        self.assertEqual(writer.end_offset(), 100)
+
+        reader = FileStream(path, consumer='c')
+        self.assertEqual(reader.read_batch(30, timeout=0), [{'x1': x} for x in range(30)])
+        self.assertEqual(len(reader.read_batch(30, timeout=0)), 30)
+        reader.ack(40)
+        # a reader which stops, records read after the acknowledged ones are read again
+        reader = FileStream(path, consumer='c')
+        self.assertEqual(reader.read_batch(1000, timeout=0), [{'x1': x} for x in range(40, 100)])
+        reader.ack()
+        writer.write({'x1': 100})
+        self.assertEqual(list(reader.read()), [{'x1': 100}])
+        reader.seek(99)
+        self.assertEqual(reader.read_batch(1000, timeout=0), [{'x1': 99}, {'x1': 100}])
+
+        # a replay stops at the end of the range and leaves the committed offset alone
+        reader.seek_range(10, 45)
+        replayed = []
+        while not reader.range_done():
+            replayed.extend(reader.read_batch(20, timeout=0))
+        self.assertEqual(replayed, [{'x1': x} for x in range(10, 45)])
+        self.assertEqual(reader.read_batch(20, timeout=0), [])
+        self.assertEqual(FileStream(path, consumer='c').offset, 101)
+
+
+class FailingQueueStream(QueueStream):
+    # output stream whose writes fail while fail is set
+    fail = True
+
+    def write_many(self, records):
+        if self.fail:
+            raise Exception("output stream is down")
+        super().write_many(records)
+
+
+class ControllerTest(unittest.TestCase):
+    # controllers against the fake MindsDB from benchmarks/fake_mindsdb.py
+    @classmethod
+    def setUpClass(cls):
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+        import fake_mindsdb
+        cls.fake_mindsdb = fake_mindsdb
+        cls.server = fake_mindsdb.start()
+        cls.mindsdb_url = os.environ.get('MINDSDB_URL')
+        os.environ['MINDSDB_URL'] = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        if cls.mindsdb_url is None:
+            os.environ.pop('MINDSDB_URL', None)
+        else:
+            os.environ['MINDSDB_URL'] = cls.mindsdb_url
+
+    def test_lingering_batch_written_before_ack(self):
+        print(f"\nExecuting {self._testMethodName}")
+        self.fake_mindsdb.PREDICTORS['regular'] = {}
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+        FileStream(path).write_many([{'x1': x} for x in range(3)])
+        stream_out = QueueStream()
+        controller = StreamController(self._testMethodName, 'regular', FileStream(path), stream_out,
+                                      batch_size=10, batch_linger=10, poll_timeout=0.1)
+        controller_thread = threading.Thread(target=controller.work)
+        controller_thread.start()
+        time.sleep(0.5)
+        self.assertEqual(FileStream(path).offset, 0)
+        controller.stop_event.set()
+        controller_thread.join()
+        self.assertEqual(len(list(stream_out.read())), 3)
+        self.assertEqual(FileStream(path).offset, 3)
+
+    def test_failed_writes_not_acked(self):
+        print(f"\nExecuting {self._testMethodName}")
+        for predictor, settings in (('regular', {}),
+                                    (f'{self._testMethodName}_{time.time()}',
+                                     {'is_timeseries': True, 'window': 2, 'order_by': ['order'], 'group_by': []})):
+            self.fake_mindsdb.PREDICTORS[predictor] = settings
+            path = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, path, True)
+            FileStream(path).write_many([{'order': x, 'x1': x} for x in range(20)])
+            stream_out = FailingQueueStream()
+            controller = StreamController(self._testMethodName, predictor, FileStream(path), stream_out,
+                                          poll_timeout=0.1)
+            controller_thread = threading.Thread(target=controller.work)
+            controller_thread.start()
+            time.sleep(0.5)
+            self.assertTrue(controller_thread.is_alive())
+            self.assertEqual(FileStream(path).offset, 0)
+            # the kept predictions are written once the output is back
+            stream_out.fail = False
+            time.sleep(0.5)
+            controller.stop_event.set()
+            controller_thread.join()
+            self.assertEqual(len(list(stream_out.read())), 20 if not settings else 19)
+            self.assertEqual(FileStream(path).offset, 20)
+
+    def test_prediction_cache_per_record(self):
+        print(f"\nExecuting {self._testMethodName}")
+        self.fake_mindsdb.PREDICTORS['regular'] = {}
+        stream_in, stream_out = QueueStream(), QueueStream()
+        records = [{'x1': x % 3} for x in range(30)]
+        stream_in.write_many(records)
+        controller = StreamController(self._testMethodName, 'regular', stream_in, stream_out,
+                                      batch_size=10, prediction_cache_size=100, poll_timeout=0.1)
+        requests_before = self.fake_mindsdb.STATS['requests']
+        controller_thread = threading.Thread(target=controller.work)
+        controller_thread.start()
+        time.sleep(0.5)
+        controller.stop_event.set()
+        controller_thread.join()
+        # only the first batch is requested, later batches are served from the cache record by record
+        self.assertEqual(self.fake_mindsdb.STATS['requests'] - requests_before, 1)
+        self.assertEqual([r['x1'] for r in stream_out.read()], [r['x1'] for r in records])
+
+    def test_multi_stream_routes_drained_on_stop(self):
+        print(f"\nExecuting {self._testMethodName}")
+        self.fake_mindsdb.PREDICTORS['regular'] = {}
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+        FileStream(path).write_many([{'x1': x} for x in range(50)])
+        outputs = [QueueStream(), QueueStream()]
+        routes = [dict(predictor='regular', stream_out=outputs[0]),
+                  dict(predictor='regular', stream_out=outputs[1], batch_size=7, batch_linger=10)]
+        controller = MultiStreamController(self._testMethodName, FileStream(path), routes, poll_timeout=0.1)
+        controller_thread = threading.Thread(target=controller.work)
+        controller_thread.start()
+        time.sleep(0.3)
+        controller.stop_event.set()
+        controller_thread.join()
+        self.assertEqual([len(list(stream_out.read())) for stream_out in outputs], [50, 50])
+        self.assertEqual(FileStream(path).offset, 50)
+
+    def test_supervisor_add_remove(self):
+        print(f"\nExecuting {self._testMethodName}")
+        self.fake_mindsdb.PREDICTORS['regular'] = {}
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+        FileStream(os.path.join(path, 'in')).write_many([{'x1': x} for x in range(20)])
+        supervisor = StreamSupervisor(self._testMethodName, workers=2, reload_interval=0.1, in_thread=True)
+        self.addCleanup(supervisor.thread.join)
+        self.addCleanup(supervisor.stop_event.set)
+        name = f'{self._testMethodName}_{time.time()}'
+        supervisor.add({'name': name, 'type': 'file', 'connection_info': {'path': path}, 'predictor': 'regular',
+                        'input_stream': 'in', 'output_stream': 'out', 'anomaly_stream': None, 'max_in_flight': 2})
+        controller = supervisor.controllers[name]
+        # a stream which fails to open isn't registered
+        predictor = f'{self._testMethodName}_{time.time()}'
+        self.fake_mindsdb.PREDICTORS[predictor] = {'is_timeseries': True, 'window': 2, 'order_by': ['order']}
+        with self.assertRaises(Exception):
+            supervisor.add({'name': name + '_ts', 'type': 'file', 'connection_info': {'path': path},
+                            'predictor': predictor, 'input_stream': 'ts', 'output_stream': 'ts_out',
+                            'scale_out': True})
+        self.assertNotIn(name + '_ts', supervisor.specs)
+        self.assertNotIn(name + '_ts', supervisor.controllers)
+        supervisor.add({'name': name + '_learning', 'type': 'file', 'connection_info': {'path': path},
+                        'predictor': 'regular', 'input_stream': 'train', 'output_stream': 'train_out',
+                        'learning_params': {'to_predict': 'y'}, 'learning_threshold': 3600})
+        deadline = time.time() + 5
+        while FileStream(os.path.join(path, 'in')).offset < 20 and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(FileStream(os.path.join(path, 'out')).read_batch(max_records=100)), 20)
+        self.assertEqual(METRICS.snapshot()[f'mindsdb_streams_records_read_total{{controller="{name}"}}'], 20)
+
+        started = time.time()
+        supervisor.remove(name)
+        # the learning controller stops collecting training data
+        supervisor.remove(name + '_learning')
+        self.assertLess(time.time() - started, 5)
+        self.assertEqual(supervisor.specs, {})
+        self.assertFalse([key for key in METRICS.snapshot() if f'controller="{name}' in key])
+        self.assertIsNone(controller.async_client)
+
+    def _ts_outputs(self, ts_bulk_size, shuffle=False, order_by=('order', ), group_by=('group', )):
+        predictor = f'{self._testMethodName}_{time.time()}_{ts_bulk_size}'
+        self.fake_mindsdb.PREDICTORS[predictor] = {'is_timeseries': True, 'window': 3,
+                                                   'order_by': order_by, 'group_by': group_by}
+        stream_in, stream_out = QueueStream(), QueueStream()
+        stream_in.write_many([{'group': g, 'order': x, 'x1': x * 10 + g} for x in range(20) for g in range(3)])
+        controller = StreamController(predictor, predictor, stream_in, stream_out, ts_bulk_size=ts_bulk_size)
+        if shuffle:
+            request_many = controller._request_many
+            controller._request_many = lambda when_list: [
+                prediction[::-1] if isinstance(prediction, list) else prediction
+                for prediction in request_many(when_list)
+            ]
+        controller_thread = threading.Thread(target=controller.work)
+        controller_thread.start()
+        time.sleep(1)
+        controller.stop_event.set()
+        controller_thread.join()
+        return [(r['group'], r['order'], r['x1']) for r in stream_out.read()]
+
+    def test_bulk_windows_match_single_predictions(self):
+        print(f"\nExecuting {self._testMethodName}")
+        expected = self._ts_outputs(1)
+        self.assertEqual(len(expected), 3 * 18)
+        self.assertEqual(self._ts_outputs(8), expected)
+        # rows that don't line up with the records sent are predicted window by window
+        self.assertEqual(self._ts_outputs(8, shuffle=True), expected)
+        # settings given as strings
+        self.assertEqual(self._ts_outputs(8, order_by='order'), expected)
+        self.assertEqual(self._ts_outputs(8, shuffle=True, order_by='order', group_by='group'), expected)
+
+
+class WindowStoreTest(unittest.TestCase):
+    def test_windows_restored_from_cache(self):
+        print(f"\nExecuting {self._testMethodName}")
+        name = f'{self._testMethodName}_{time.time()}'
+        store = WindowStore(name, ['order'], 3)
+        for x in (3, 1, 2, 4):
+            store.append('A', {'order': x})
+        store.append('B', {'order': 1})
+        self.assertEqual(store.pop_dirty(), {'A', 'B'})
+        self.assertEqual(store.pop_dirty(), set())
+
+        windows = list(store.windows('A'))
+        self.assertEqual([[wd['order'] for wd in w] for w in windows], [[1, 2, 3], [2, 3, 4]])
+        store.stop()
+
+        store = WindowStore(name, ['order'], 3)
+        store.restore()
+        self.assertEqual(store.size('A'), 2)
+        store.append('A', {'order': 5})
+        self.assertEqual(len(list(store.windows('A'))), 1)
+
+    def test_windows_ordering_and_tolerance(self):
+        print(f"\nExecuting {self._testMethodName}")
+        store = WindowStore(f'{self._testMethodName}_{time.time()}', ['order'], 2, tolerance=1)
+        for x in ('2021-01-03', '2021-01-01T00:00:00Z', '2021-01-02'):
+            store.append('A', {'order': x})
+        windows = list(store.windows('A'))
+        self.assertEqual([[wd['order'] for wd in w] for w in windows], [['2021-01-01T00:00:00Z', '2021-01-02']])
+
+        # behind the watermark
+        self.assertFalse(store.append('A', {'order': '2020-12-31'}))
+        self.assertTrue(store.append('A', {'order': '2021-01-04'}))
+        self.assertEqual(store.size('A'), 3)
+
+        store = WindowStore(f'{self._testMethodName}_{time.time()}', ['order'], 2)
+        for x in ('10', '9', 11):
+            store.append('A', {'order': x})
+        self.assertEqual([w[0]['order'] for w in store.windows('A')], ['9', '10'])
+
+    def test_windows_not_cached(self):
+        print(f"\nExecuting {self._testMethodName}")
+        name = f'{self._testMethodName}_{time.time()}'
+        store = WindowStore(name, ['order'], 2, cached=False)
+        for x in (1, 2, 3):
+            store.append('A', {'order': x})
+        self.assertEqual(len(list(store.windows('A'))), 2)
+        store.stop()
+        self.assertIsNone(store.cache)
+
+        # nothing was saved
+        store = WindowStore(name, ['order'], 2)
+        store.restore()
+        self.assertEqual(store.keys(), [])
+
+
+class TrainingSpoolTest(unittest.TestCase):
+    def test_spool_limits_and_sampling(self):
+        print(f"\nExecuting {self._testMethodName}")
+        spool = TrainingSpool(max_rows=10, chunk_size=3)
+        spool.add_many({'x1': x} for x in range(5))
+        spool.add_many([{'x1': x, 'x2': x} for x in range(5, 20)])
+        self.assertTrue(spool.is_full)
+        df = pd.read_csv(spool.to_csv())
+        self.assertEqual(list(df.columns), ['x1', 'x2'])
+        self.assertEqual(list(df['x1']), list(range(10)))
+        spool.close()
+
+        spool = TrainingSpool(sample_size=5, chunk_size=3, seed=1)
+        spool.add_many({'x1': x} for x in range(100))
+        df = pd.read_csv(spool.to_csv())
+        self.assertEqual(len(df), 5)
+        self.assertEqual(list(df['x1']), sorted(df['x1']))
+        spool.close()
+
+    def test_arrow_formats(self):
+        print(f"\nExecuting {self._testMethodName}")
+        records = [{'x1': True, 'x2': 1.5, 'x3': 'a'}, {'x1': 2, 'x2': 2, 'x3': None}, {'x1': None, 'x3': [1]}]
+        for format in ('parquet', 'arrow'):
+            spool = TrainingSpool()
+            spool.add_many(records)
+            path = spool.to_file(format)
+            df = pd.read_parquet(path) if format == 'parquet' else pd.read_feather(path)
+            self.assertEqual(list(df.columns), ['x1', 'x2', 'x3'])
+            self.assertEqual(list(df['x1'][:2]), [1, 2])
+            self.assertEqual(list(df['x2'][:2]), [1.5, 2.0])
+            self.assertEqual(list(df['x3'].fillna('')), ['a', '', '[1]'])
+            spool.close()
+
+    def test_rolling_window_and_drift(self):
+        print(f"\nExecuting {self._testMethodName}")
+        window = RollingSpool(window_rows=30, segment_rows=10)
+        for i in range(10):
+            window.add_many({'x1': x} for x in range(i * 10, i * 10 + 10))
+        self.assertEqual(len(window), 30)
+        df = pd.read_csv(window.to_csv())
+        self.assertEqual(list(df['x1']), list(range(70, 100)))
+        window.close()
+        with self.assertRaises(Exception):
+            RollingSpool()
+
+        detector = MeanShiftDetector(threshold=3, min_records=10)
+        detector.add_many({'x1': x % 5} for x in range(50))
+        detector.reset()
+        detector.add_many({'x1': x % 5} for x in range(50))
+        self.assertFalse(detector.is_drifted())
+        detector.add_many({'x1': 100} for _ in range(50))
+        self.assertTrue(detector.is_drifted())
+
+
+class MetricsTest(unittest.TestCase):
+    def test_render(self):
+        print(f"\nExecuting {self._testMethodName}")
+        metrics = Metrics(prefix='test')
+        metrics.counter('records_total', 'records', controller='a').inc(3)
+        metrics.gauge('depth', controller='a').set_function(lambda: 7)
+        histogram = metrics.histogram('latency_seconds', buckets=(0.1, 1), controller='a')
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value)
+        text = metrics.render()
+        self.assertIn('# HELP test_records_total records', text)
+        self.assertIn('test_records_total{controller="a"} 3', text)
+        self.assertIn('test_depth{controller="a"} 7', text)
+        self.assertIn('test_latency_seconds_bucket{controller="a",le="1"} 2', text)
+        self.assertIn('test_latency_seconds_bucket{controller="a",le="+Inf"} 3', text)
+        self.assertEqual(histogram.quantile(0.5), 1)
+        self.assertIs(metrics.counter('records_total', controller='a'), metrics.counter('records_total', controller='a'))
+
+
 if __name__ == "__main__":
     try:
         unittest.main(failfast=True)